@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+#
+# Bluetooth serial link supervisor
+#
+# Binds the BLUETOOTH devices (rfcomm for classic devices, ble_serial for
+# BLE devices) and runs one serial-daemon.py per device. A daemon exit is
+# noticed immediately through SIGCHLD, only the failed device is bound
+# again and its daemon restarted, with an exponential backoff between
+# consecutive failures. The other links keep running.
+#
+# If BLUETOOTH_WATCHDOG is enabled, each link is health-checked every
+# BLUETOOTH_HEALTH_INTERVAL seconds by sending BLUETOOTH_HEALTH_COMMAND as
+# a queued request through the socket of its serial-daemon, so the check
+# never competes with the daemon for the serial port. After
+# HEALTH_FAILURES consecutive failed checks the link is released and
+# bound again. In bind-only mode (BLUETOOTH_BIND_ONLY), where no daemons
+# run, the check opens the port with serial-command instead.
+#
+# Usage: btsupervisor.py
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import json
+import time
+import queue
+import select
+import signal
+import socket
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+
+
+# Log prefix, also passed to the serial daemons
+PREFIX = "bt-daemon"
+
+# Scripts started by the supervisor
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serial-daemon.py")
+SERIAL_COMMAND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "serial-command")
+
+# Socket of the serial daemon of a device, same as in serial-daemon.py
+SOCKET_PATH = "/tmp/serial-daemon-{}.sock"
+
+# Restart backoff in seconds, doubled after every failure up to BACKOFF_MAX
+BACKOFF_MIN = 2
+BACKOFF_MAX = 300
+
+# A daemon running for this many seconds resets the backoff
+STABLE_TIME = 600
+
+# Health checks
+HEALTH_INTERVAL = 600   # Default interval in seconds
+HEALTH_COMMAND = "s"    # Default command
+HEALTH_TIMEOUT = 60     # Response timeout in seconds
+HEALTH_FAILURES = 2     # Consecutive failures causing a restart
+
+# Time in seconds to wait for a device node after binding
+BIND_TIMEOUT = 30
+BLE_BIND_TIMEOUT = 10
+
+# Time in seconds to wait for a daemon to exit before killing it
+STOP_TIMEOUT = 5
+
+
+# Send a request through the socket of a serial daemon, returns the reply
+# status ("ok", "timeout" or "error") and the response or error message
+def request(device, command, timeout):
+    request_id = f"{os.getpid()}-{time.monotonic_ns()}"
+    message = {"id": request_id, "command": command, "timeout": timeout}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            # Allow some slack for the daemon to report its own timeout
+            sock.settimeout(timeout + 5)
+            sock.connect(SOCKET_PATH.format(device))
+            sock.sendall((json.dumps(message) + "\n").encode())
+            data = b""
+            while b"\n" not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return "error", "connection closed by the serial daemon"
+                data += chunk
+    except socket.timeout:
+        return "timeout", "no reply from the serial daemon"
+    except OSError as e:
+        return "error", str(e)
+    try:
+        reply = json.loads(data.split(b"\n", 1)[0])
+    except ValueError:
+        return "error", "invalid reply from the serial daemon"
+    if reply.get("id") != request_id:
+        return "error", "unexpected reply from the serial daemon"
+    return reply.get("status", "error"), reply.get("response", "")
+
+
+class Link:
+    """
+    State of a supervised Bluetooth device.
+    """
+    def __init__(self, device, address, mode):
+        self.device = device
+        self.address = address
+        self.mode = mode
+        self.daemon = None         # serial-daemon process
+        self.ble = None            # ble_serial process of a BLE device
+        self.started = 0           # Start time of the daemon
+        self.failures = 0          # Consecutive failures, sets the backoff
+        self.restart_at = 0        # Time of the next start, None while running
+        self.rebind = False        # Release the device before binding it again
+        self.next_check = None     # Time of the next health check
+        self.checking = False      # Health check in progress
+        self.check_failures = 0    # Consecutive failed health checks
+
+
+class Supervisor:
+    """
+    Binds the Bluetooth devices and supervises their serial daemons.
+
+    links:      list of Link objects
+    bind_only:  only bind the devices, do not start any daemons
+    watchdog:   run the health checks
+    """
+    def __init__(self, links, log, bind_only=False, watchdog=True,
+                 health_interval=HEALTH_INTERVAL, health_command=HEALTH_COMMAND):
+        self.links = links
+        self.log = log
+        self.bind_only = bind_only
+        self.watchdog = watchdog
+        self.health_interval = health_interval
+        self.health_command = health_command
+        self.results = queue.Queue()   # Health check results as (link, status, message)
+        self.terminate = False
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            os.set_blocking(fd, False)
+
+    # Bind a device, returns True if the device node is available
+    def bind(self, link):
+        path = f"/dev/{link.device}"
+        if link.mode == "ble":
+            if link.rebind and link.ble is not None:
+                self.stop(link.ble)
+                link.ble = None
+            if os.path.exists(path):
+                self.log.info(f"BLE device node {path} already present")
+                return True
+            self.log.info(f"Binding BLE {path} to {link.address}")
+            link.ble = subprocess.Popen([sys.executable, "-m", "ble_serial", "-d", link.address, "-p", path])
+            timeout = BLE_BIND_TIMEOUT
+        else:
+            if link.rebind:
+                subprocess.run(["rfcomm", "release", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if os.path.exists(path):
+                self.log.info(f"{path} already bound")
+                return True
+            self.log.info(f"Binding {path} to {link.address}")
+            if subprocess.run(["rfcomm", "bind", path, link.address]).returncode != 0:
+                return False
+            timeout = BIND_TIMEOUT
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self.terminate:
+            if os.path.exists(path):
+                self.log.info(f"{path} bound successfully")
+                return True
+            time.sleep(0.5)
+        return False
+
+    # Bind a device and start its daemon, schedules a restart on failure
+    def start(self, link):
+        if not self.bind(link):
+            self.log.error(f"Failed to bind Bluetooth device (device=/dev/{link.device} address={link.address})")
+            self.schedule(link)
+            return
+        link.rebind = False
+        link.restart_at = None
+        link.check_failures = 0
+        link.started = time.monotonic()
+        if self.watchdog:
+            link.next_check = link.started + self.health_interval
+        if not self.bind_only:
+            self.log.info(f"Connecting Bluetooth device (device=/dev/{link.device} mode={link.mode} address={link.address})")
+            link.daemon = subprocess.Popen([DAEMON_SCRIPT, link.device, PREFIX])
+
+    # Schedule the restart of a device with exponential backoff
+    def schedule(self, link):
+        if link.started and time.monotonic() - link.started >= STABLE_TIME:
+            link.failures = 0
+        delay = min(BACKOFF_MAX, BACKOFF_MIN * 2 ** link.failures)
+        link.failures += 1
+        link.restart_at = time.monotonic() + delay
+        link.next_check = None
+        self.log.info(f"Restarting /dev/{link.device} in {delay} s")
+
+    # Stop a process, kills it if it does not exit in time
+    def stop(self, process):
+        if process.poll() is not None:
+            return
+        process.send_signal(signal.SIGINT)   # serial-daemon.py exits cleanly on SIGINT
+        try:
+            process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    # Collect the exited daemons, only the supervised processes are waited for
+    def reap(self):
+        for link in self.links:
+            if link.ble is not None and link.ble.poll() is not None:
+                self.log.warning(f"ble_serial exited (device=/dev/{link.device} exit code {link.ble.returncode})")
+                link.ble = None
+                if link.daemon is not None:
+                    self.stop(link.daemon)   # Restarted below once the daemon has exited
+                else:
+                    link.rebind = True       # No daemon in bind-only mode
+                    self.schedule(link)
+            if link.daemon is not None and link.daemon.poll() is not None:
+                self.log.warning(f"serial-daemon exited (device=/dev/{link.device} pid={link.daemon.pid} exit code {link.daemon.returncode})")
+                link.daemon = None
+                link.rebind = True
+                self.schedule(link)
+
+    # Health check of a link, runs in a separate thread
+    def check(self, link):
+        if self.bind_only:
+            try:
+                result = subprocess.run([SERIAL_COMMAND, f"/dev/{link.device}", "9600", self.health_command],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=HEALTH_TIMEOUT)
+                status = "ok" if result.returncode == 0 else "error"
+                message = result.stderr.strip()
+            except subprocess.TimeoutExpired:
+                status, message = "timeout", "Timeout reached while calling serial-command"
+            except OSError as e:
+                status, message = "error", str(e)
+        else:
+            status, message = request(link.device, self.health_command, HEALTH_TIMEOUT)
+        self.results.put((link, status, message))
+        self.wake()
+
+    # Process the results of the finished health checks
+    def checked(self):
+        while not self.results.empty():
+            link, status, message = self.results.get()
+            link.checking = False
+            if link.restart_at is not None:
+                continue   # Restarted in the meantime
+            if status == "ok":
+                link.check_failures = 0
+                link.failures = 0
+                continue
+            link.check_failures += 1
+            self.log.warning(f"Health check of /dev/{link.device} failed ({status}: {message or 'no response'})")
+            if link.check_failures >= HEALTH_FAILURES:
+                self.log.info(f"Restarting /dev/{link.device} after {link.check_failures} failed health checks")
+                link.rebind = True
+                if link.daemon is not None:
+                    self.stop(link.daemon)   # Restarted by reap()
+                else:
+                    self.schedule(link)
+
+    # Wake up the main loop
+    def wake(self, *args):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    # Stop the main loop
+    def stop_all(self, *args):
+        self.terminate = True
+        self.wake()
+
+    # Supervise the links until SIGTERM or SIGINT
+    def run(self):
+        signal.set_wakeup_fd(self._wake_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)   # Wakes up select() through the wakeup fd
+        signal.signal(signal.SIGTERM, self.stop_all)
+        signal.signal(signal.SIGINT, self.stop_all)
+
+        for link in self.links:
+            if not self.terminate:
+                self.start(link)
+
+        while not self.terminate:
+            now = time.monotonic()
+            deadlines = [l.restart_at for l in self.links if l.restart_at is not None]
+            deadlines += [l.next_check for l in self.links if l.next_check is not None and not l.checking]
+            timeout = max(0, min(deadlines) - now) if deadlines else None
+            try:
+                select.select([self._wake_r], [], [], timeout)
+            except InterruptedError:
+                pass
+            try:
+                while os.read(self._wake_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+            self.reap()
+            self.checked()
+            now = time.monotonic()
+            for link in self.links:
+                if self.terminate:
+                    break
+                if link.restart_at is not None and link.restart_at <= now:
+                    self.log.info(f"Restarting serial daemon (device=/dev/{link.device} mode={link.mode} address={link.address})")
+                    self.start(link)
+                elif link.next_check is not None and link.next_check <= now and not link.checking:
+                    link.checking = True
+                    link.next_check = now + self.health_interval
+                    threading.Thread(target=self.check, args=(link,), daemon=True).start()
+
+        self.log.info("Cleanup on exit")
+        for link in self.links:
+            for process in (link.daemon, link.ble):
+                if process is not None:
+                    self.stop(process)
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    config = Config()
+    nlog = NLog(PREFIX, mode="ecd")
+    nlog.info("Bluetooth daemon started")
+
+    # Each entry BLUETOOTH[i] is expected to be: "<device> <address> [<mode>]"
+    links = []
+    for entry in config.array("BLUETOOTH").values():
+        fields = entry.split()
+        if len(fields) >= 2:
+            links.append(Link(fields[0], fields[1], fields[2] if len(fields) > 2 else ""))
+    if not links:
+        nlog.error("No Bluetooth devices configured (CFG_BLUETOOTH is empty) — exiting")
+        nlog.close()
+        sys.exit(1)
+
+    supervisor = Supervisor(links, nlog,
+                            bind_only=config.getint("BLUETOOTH_BIND_ONLY", 0) == 1,
+                            watchdog=config.getint("BLUETOOTH_WATCHDOG", 0) == 1,
+                            health_interval=config.getint("BLUETOOTH_HEALTH_INTERVAL", HEALTH_INTERVAL),
+                            health_command=config.get("BLUETOOTH_HEALTH_COMMAND", HEALTH_COMMAND))
+    supervisor.run()
+    nlog.close()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#
+# Search a list of directories for corrupted image files
+#
+# Images are decoded on a process pool sized to the number of CPUs. The
+# result of every check is stored together with the file size and
+# modification time in a verification cache, so that unchanged files are
+# not decoded again on the next run. The cache is committed while the scan
+# is running, a scan that has been stopped by removing the lock directory
+# resumes where it left off.
+#
+# Cached failures are reported on every run until the file is replaced.
+#
+# Images larger than MAX_PIXELS are not decoded at full size: JPEGs are
+# decoded at a reduced scale, other images are checked with identify if
+# available and reported as failed otherwise.
+#
+# Uses the following optional packages:
+# - python3-pil: for decoding the images in-process
+# - imagemagick: for checking the images if python3-pil is not installed
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import subprocess
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+
+try:
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None   # Large images are limited by MAX_PIXELS instead
+    pil_available = True
+except ImportError:
+    pil_available = False
+
+
+# Images with more pixels are decoded at a reduced scale (JPEG) or checked
+# with identify, a full decode of several of them at once on the worker pool
+# could exhaust the memory of a Raspberry Pi
+MAX_PIXELS = 50 * 1000 * 1000
+
+# Image file name pattern, same as the former find regex
+PATTERN = re.compile(r".*\.(jpg|JPG|jpeg|JPEG|png|PNG)")
+
+# Number of results after which the cache is committed
+COMMIT_COUNT = 100
+
+# Maximum time in seconds between cache commits
+COMMIT_INTERVAL = 10
+
+# Highest code point, upper bound for prefix range queries
+_MAX_CHAR = chr(0x10ffff)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checked (
+    path    TEXT PRIMARY KEY,
+    size    INTEGER NOT NULL,
+    mtime   INTEGER NOT NULL,
+    ok      INTEGER NOT NULL,
+    result  TEXT NOT NULL,
+    time    INTEGER NOT NULL
+);
+"""
+
+
+# Decode an image, runs on the worker pool. Returns a tuple of
+# (path, size, mtime, ok, result) or None if the file has disappeared
+def verify(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not pil_available:
+        return (path, st.st_size, int(st.st_mtime)) + identify(path)
+    try:
+        with Image.open(path) as img:
+            pixels = img.width * img.height
+            if pixels > MAX_PIXELS:
+                if img.format != "JPEG":
+                    if shutil.which("identify") is not None:
+                        return (path, st.st_size, int(st.st_mtime)) + identify(path)
+                    raise Image.DecompressionBombError(f"{img.width}x{img.height} pixels exceed the limit of {MAX_PIXELS}")
+                # The JPEG decoder scales the image down while decoding
+                scale = (MAX_PIXELS / pixels) ** 0.5
+                img.draft(img.mode, (int(img.width * scale), int(img.height * scale)))
+            img.load()
+        ok, result = True, os.path.basename(path)
+    except Exception as e:
+        ok, result = False, f"{path}: {e}"
+    return path, st.st_size, int(st.st_mtime), ok, result
+
+
+# Check an image with ImageMagick, returns a tuple of (ok, result)
+def identify(path):
+    proc = subprocess.run(["identify", "-format", "%f", path],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+    return proc.returncode == 0, f"{proc.stdout.strip()} (returned {proc.returncode})"
+
+
+# Image files below directory as (path, size, mtime) tuples
+def scan(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            path = os.path.join(root, f)
+            if PATTERN.fullmatch(path):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, int(st.st_mtime)
+
+
+class KilledException(Exception):
+    pass
+
+
+class VerificationCache:
+    """
+    Results of previous checks stored in the SQLite database at path.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    # Cached results below directory as a dictionary of path: (size, mtime, ok, result)
+    def load(self, directory):
+        prefix = os.path.join(directory, "")
+        rows = self.db.execute("SELECT path, size, mtime, ok, result FROM checked WHERE path >= ? AND path < ?",
+                               (prefix, prefix + _MAX_CHAR))
+        return {row[0]: row[1:] for row in rows}
+
+    # Store the result of a check, committed by commit()
+    def store(self, path, size, mtime, ok, result):
+        self.db.execute("INSERT OR REPLACE INTO checked (path, size, mtime, ok, result, time) VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, size, mtime, int(ok), result, int(time.time())))
+
+    # Remove the results of files that no longer exist
+    def remove(self, paths):
+        self.db.executemany("DELETE FROM checked WHERE path = ?", ((p,) for p in paths))
+
+    def commit(self):
+        self.db.commit()
+
+
+class CheckImages:
+    """
+    Checks the images below the configured directories for integrity.
+
+    lock:    lock directory, deleting it stops the execution
+    cache:   verification cache database, or None
+    workers: size of the worker pool
+    full:    check all files, including the unchanged ones found in the cache
+    """
+    def __init__(self, log, lock, cache=None, workers=None, full=False):
+        self.lock = lock
+        self.cache = VerificationCache(cache) if cache else None
+        self.workers = workers or os.cpu_count()
+        self.full = full
+        self.nlog = NLog("check-images", log=log, mode="ecd")
+        self.fail_count = 0
+        self.total_count = 0
+        self.checked_count = 0
+
+    # Print info message to log file
+    def info_log(self, text):
+        self.nlog.info(text)
+
+    # Print warning message to log file
+    def warning_log(self, text):
+        self.nlog.warning(text)
+
+    # Print error message to log file
+    def error_log(self, text):
+        self.nlog.error(text)
+
+    # Stop the execution if the lock directory has been deleted
+    def check_lock(self):
+        if not os.path.exists(self.lock):
+            self.warning_log(f"KILLED DUE TO REMOVED {self.lock}")
+            raise KilledException()
+
+    # Count and report the result of a check
+    def report(self, path, ok, result):
+        if not ok:
+            self.error_log(result)
+            self.fail_count += 1
+        self.total_count += 1
+
+    # Main processing routine
+    def process(self, directory):
+        print(" ")
+        print(f"directory: {directory} ")
+        print(f"pattern:   {PATTERN.pattern} ")
+        if not os.path.exists(directory):
+            self.error_log(f"directory '{directory}' does not exist")
+            return
+        directory = os.path.abspath(directory)
+
+        cached = self.cache.load(directory) if self.cache is not None else {}
+        pending = []
+        found = set()
+        for path, size, mtime in scan(directory):
+            found.add(path)
+            entry = cached.get(path)
+            if not self.full and entry is not None and entry[0:2] == (size, mtime):
+                self.report(path, entry[2], entry[3])
+            else:
+                pending.append(path)
+
+        if self.cache is not None:
+            self.cache.remove(p for p in cached if p not in found)
+            self.cache.commit()
+        print(f"checking {len(pending)} of {len(found)} files ...")
+        if not pending:
+            return
+
+        with Pool(self.workers) as pool:
+            uncommitted = 0
+            last_commit = time.monotonic()
+            try:
+                for entry in pool.imap_unordered(verify, pending, chunksize=4):
+                    self.check_lock()
+                    if entry is None:
+                        continue
+                    path, size, mtime, ok, result = entry
+                    print(f"checked {path}: {'OK' if ok else 'FAILED'}")
+                    self.report(path, ok, result)
+                    self.checked_count += 1
+                    if self.cache is not None:
+                        self.cache.store(path, size, mtime, ok, result)
+                        uncommitted += 1
+                        if uncommitted >= COMMIT_COUNT or time.monotonic() - last_commit > COMMIT_INTERVAL:
+                            self.cache.commit()
+                            uncommitted = 0
+                            last_commit = time.monotonic()
+            finally:
+                # Keep the results checked so far for resuming an interrupted scan
+                if self.cache is not None:
+                    self.cache.commit()
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+
+# Semaphore lock, same as semaphoreLock in semaphore.sh
+def semaphore_lock(path):
+    try:
+        os.mkdir(path)
+        return True
+    except OSError:
+        return False
+
+
+# Semaphore release, same as semaphoreRelease in semaphore.sh
+def semaphore_release(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="Search a list of directories for corrupted image files"
+    )
+    parser.add_argument("-f", "--full", action="store_true", help="Check all files, including the unchanged ones")
+    parser.add_argument("-c", "--cache", help="Verification cache database (default: MEDIA_CHKIMG_CACHE)")
+    parser.add_argument("-l", "--lock", help="Lock directory (default: TMPFS_DIR/check-images.lock)")
+    parser.add_argument("-w", "--workers", type=int, help="Worker pool size (default: number of CPUs)")
+    parser.add_argument("directory", nargs="*", help="Directories to check (default: MEDIA_CHKIMG_DIR relative to MEDIA_ROOT_DIR)")
+    args = parser.parse_args()
+
+    config = Config()
+    log = os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "check-images.log")
+    lock = args.lock or os.path.join(config.get("TMPFS_DIR", "/tmp"), "check-images.lock")
+    cache = args.cache if args.cache is not None else config["MEDIA_CHKIMG_CACHE"]
+    directories = args.directory or [os.path.join(config["MEDIA_ROOT_DIR"], d) for d in config.array("MEDIA_CHKIMG_DIR").values()]
+
+    if not pil_available and shutil.which("identify") is None:
+        NLog("check-images", log=log, mode="ecd").error("neither python3-pil nor imagemagick is installed")
+        sys.exit(1)
+
+    checker = CheckImages(log, lock, cache, args.workers, args.full)
+
+    # Enforce a single instance of this script
+    if not semaphore_lock(lock):
+        checker.warning_log(f"an instance of the current script is already running (please remove {lock})")
+        sys.exit(1)
+
+    print(" ")
+    print(" ")
+    print("##############################")
+    print("Checking image files")
+    print(time.strftime("%c"))
+    print("##############################")
+
+    try:
+        for directory in directories:
+            checker.process(directory)
+    except KilledException:
+        checker.close()
+        sys.exit(1)
+
+    checker.close()
+    print(" ")
+    print(f"decoded {checker.checked_count} new or modified files")
+    checker.info_log(f"checked {checker.total_count} image files with {checker.fail_count} errors")
+
+    semaphore_release(lock)
+    sys.exit(0)
@@ -3,6 +3,28 @@
 # Remove old incremental backups
 # Emulating the behavior of Apple Time Machine
 #
+# The whole delete plan is computed up front by RetentionPlanner from the
+# list of backup folder names: hourly backups are thinned out after 2 days,
+# daily backups after 28 days and weekly backups after 56 days. If the free
+# disk space is below FREE_PERCENT, the oldest remaining backups are added
+# to the plan until the space reclaimed by deleting them is sufficient, but
+# at most MAX_SPACE_DELETIONS per run. A backup that would reclaim no space
+# ends the plan, as the disk is then filled by something else.
+#
+# The space reclaimed by deleting a backup is the size of the inodes whose
+# hard links are all within the deleted backups. It is looked up in the
+# snapshot index (BACKUP_INDEX_DB, see lib/snapindex.py) if the index covers
+# all backups, otherwise it is estimated by walking the backup trees (see
+# LinkEstimator).
+#
+# Deleted backups are moved to the trash and removed by a background
+# process (see lib/trash.py). Backups are not deleted for freeing disk space
+# while the trash of a previous run is not empty, as its space has not been
+# reclaimed yet. Entries left behind by a failed or interrupted deletion
+# are deleted again by a new background process.
+#
+# Usage: cleanup.py <path> [--dry-run]
+#
 # This source file is part of the follwoing repository:
 # http://www.github.com/microfarad-de/nastia-server
 #
@@ -28,142 +50,264 @@
 
 import sys
 import re
-import shutil
 import os
 import logging
-from systemd.journal import JournalHandler
 from datetime import datetime
-from os import listdir
-from os import popen
 
-# Current directory where this script is located
-dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+from lib import trash
 
 # Minimum allowed free backup disk space in percent
 FREE_PERCENT = 5
 
-#print 'Number of arguments:', len(sys.argv), 'arguments.'
-#print 'Argument List:', str(sys.argv)
+# Maximum number of backups deleted per run for freeing disk space
+MAX_SPACE_DELETIONS = 5
+
+# Backup folder name pattern and date format
+NAME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}-\d{6}$")
+NAME_FORMAT = "%Y-%m-%d-%H%M%S"
+
+# Time Machine rules as (age, spacing) in days: backups older than age are
+# removed if they are less than spacing days newer than the previous kept one
+RULES = ((2, 1), (28, 7), (56, 28))
+
+# Reasons for deleting a backup
+REASON_RULE = "rule"
+REASON_SPACE = "space"
+
+GB = 1024 ** 3
+
+
+# Backup folder names within a list of names, sorted from oldest to newest
+def backup_names(names):
+    return sorted(n for n in names if NAME_PATTERN.match(n))
+
+
+# Free and total disk space in bytes of the file system containing path
+def disk_space(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize, st.f_blocks * st.f_frsize
+
+
+class RetentionPlanner:
+    """
+    Computes the backups to be deleted.
+
+    names:         backup folder names in NAME_FORMAT, in any order
+    free_percent:  minimum free disk space in percent of the total
+    max_deletions: maximum number of backups deleted for freeing disk space
+    """
+    def __init__(self, names, free_percent=FREE_PERCENT, max_deletions=MAX_SPACE_DELETIONS):
+        self.names = backup_names(names)
+        self.free_percent = free_percent
+        self.max_deletions = max_deletions
+
+    # Backup date rounded down to the nearest minute
+    @staticmethod
+    def date(name):
+        return datetime.strptime(name, NAME_FORMAT).replace(second=0)
+
+    # Backups to be removed according to RULES, relative to the newest backup
+    def expired(self):
+        if not self.names:
+            return []
+        today = self.date(self.names[-1])
+        last = datetime(1970, 1, 1)
+        result = []
+        for name in self.names:
+            t = self.date(name)
+            age = today - t
+            delta = t - last
+            if any(age.days > max_age and delta.days < spacing for max_age, spacing in RULES):
+                result.append(name)
+                continue
+            last = t
+        return result
+
+    # Complete delete plan as a list of (name, reason, reclaimed bytes or None).
+    # free and total are the current disk space in bytes. reclaim(name) returns
+    # the bytes freed by deleting a backup in addition to the ones planned before,
+    # it is called in plan order, only if needed or if estimate is True.
+    # At most max_deletions backups are added for freeing disk space, the
+    # first backup reclaiming no space ends the plan. The newest backup is
+    # never deleted.
+    def plan(self, free, total, reclaim=None, estimate=False):
+        required = total * self.free_percent / 100
+        expired = self.expired()
+        estimate = reclaim is not None and (estimate or free < required)
+        result = []
+        for name in expired:
+            size = reclaim(name) if estimate else None
+            free += size or 0
+            result.append((name, REASON_RULE, size))
 
-# Check for correct number of arguments
-if len(sys.argv) < 1:
-    print("usage: " + sys.argv[0] + " <path> [--dry-run]")
-    sys.exit()
+        if reclaim is None:
+            return result
+        remaining = [n for n in self.names[:-1] if n not in expired]
+        for name in remaining[:self.max_deletions]:
+            if free >= required:
+                break
+            size = reclaim(name)
+            if not size:
+                break
+            free += size
+            result.append((name, REASON_SPACE, size))
+        return result
 
-# Parse arguments
-backupPath = sys.argv[1]
-dirList = []
 
-# Initialize logger
-logger = logging.getLogger('cleanup')
-logger.addHandler(JournalHandler())
-logger.setLevel(logging.INFO)
+class LinkEstimator:
+    """
+    Estimates the space reclaimed by deleting backups below root, callable
+    as the reclaim argument of RetentionPlanner.plan().
 
-print(" ")
-print("cleaning-up backups folder:", backupPath, "...")
+    Each backup tree is walked once. An inode is reclaimed when all of its
+    hard links have been seen within the backups passed so far.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.links = {}   # Inode: links seen so far, for partially reclaimed inodes
 
-# Check if dry run
-dryRun = 0
-if len(sys.argv) == 3:
-    if sys.argv[2] == "--dry-run":
-        dryRun = 1
+    def __call__(self, name):
+        reclaimed = 0
+        for st in self._walk(os.path.join(self.root, name)):
+            key = (st.st_dev, st.st_ino)
+            seen = self.links.get(key, 0) + 1
+            if seen >= st.st_nlink:
+                self.links.pop(key, None)
+                reclaimed += st.st_blocks * 512
+            else:
+                self.links[key] = seen
+        return reclaimed
+
+    # Stat results of all entries below path, directories included
+    def _walk(self, path):
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                except OSError:
+                    continue
+                yield st
+        try:
+            yield os.lstat(path)
+        except OSError:
+            pass
+
+
+# Print a disk space summary
+def print_space(free, total):
+    print(f"available disk space: {free / GB:.1f} GB ({round(free * 100 / total)}%)")
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Check for correct number of arguments
+    if len(sys.argv) < 2:
+        print("usage: " + sys.argv[0] + " <path> [--dry-run]")
+        sys.exit()
+
+    # Parse arguments
+    backupPath = sys.argv[1]
+    dryRun = len(sys.argv) == 3 and sys.argv[2] == "--dry-run"
+
+    # Initialize logger
+    from systemd.journal import JournalHandler
+    logger = logging.getLogger('cleanup')
+    logger.addHandler(JournalHandler())
+    logger.setLevel(logging.INFO)
+    nlog = NLog("cleanup", mode="c")
+
+    # Print info log message
+    def infoLog(text):
+        logger.info(text)
+        print(text)
+        nlog.info(text)
+
+    # Print warning log message
+    def warningLog(text):
+        logger.warning(text)
+        print("[WARNING] " + text)
+        nlog.warning(text)
+
+    print(" ")
+    print("cleaning-up backups folder:", backupPath, "...")
+    if dryRun:
         print("dry run")
 
+    config = Config()
+    planner = RetentionPlanner(os.listdir(backupPath))
+    free, total = disk_space(backupPath)
+    print_space(free, total)
+
+    # Prefer the snapshot index over walking the backup trees
+    from lib.snapindex import SnapshotIndex
+    index = None
+    reclaim = LinkEstimator(backupPath)
+    if config["BACKUP_INDEX_DB"]:
+        try:
+            index = SnapshotIndex(config["BACKUP_INDEX_DB"])
+            if index.covers(planner.names):
+                reclaim = index.estimator(planner.names)
+                print("using the snapshot index")
+        except Exception as e:
+            warningLog(f"failed to open the snapshot index: {e}")
+            index = None
+    leftover = trash.pending(backupPath)
+    if leftover and trash.busy(backupPath):
+        warningLog(f"deletion of {', '.join(leftover)} still in progress, not freeing disk space")
+        reclaim = None
+    elif leftover:
+        warningLog(f"{', '.join(leftover)} left in the trash by a previous run, not freeing disk space")
+        reclaim = None
+    plan = planner.plan(free, total, reclaim, estimate=dryRun)
+    if reclaim is not None and free + sum(size or 0 for name, reason, size in plan) < total * FREE_PERCENT / 100:
+        warningLog(f"available disk space remains below {FREE_PERCENT}% after deleting "
+                   f"at most {MAX_SPACE_DELETIONS} backups for freeing disk space")
 
-# Print info log message
-def infoLog(text):
-    global dir
-    global logger
-    logger.info(text)
-    print(text)
-    popen(dir + "/infoLog.sh \"" + text + "\" 'cleanup' '' 'c'")
-
-
-# Print warning log message
-def warningLog(text):
-    global dir
-    global logger
-    logger.warning(text)
-    print("[WARNING] " + text)
-    popen(dir + "/warningLog.sh \"" + text + "\" 'cleanup' '' 'c'")
-
-
-# Print error log message
-def errorLog(text):
-    global dir
-    global logger
-    logger.error(text)
-    print("[ERROR] " + text)
-    popen(dir + "/errorLog.sh \"" + text + "\" 'cleanup' '' 'c'")
-
-
-# Collect the backup folders
-for d in listdir(backupPath):
-    match = re.search("^\d{4}-\d{2}-\d{2}-\d{6}$", d)
-    if match:
-        dirList.append(d)
-
-# Sort them in alphabetical order
-dirList.sort()
-
-# Initialize timestamps
-today = datetime.strptime(dirList[len(dirList) - 1], "%Y-%m-%d-%H%M%S")
-today = today.replace(second=0)  # Round-down to the nearest minute
-lastT = datetime(1970, 1, 1)
-
-# Iterate over backup directories and delete according to rules
-for d in dirList:
-    t = datetime.strptime(d, "%Y-%m-%d-%H%M%S")
-    t = t.replace(second=0)  # Round-down to the nearest minute
-    age = today - t
-    delta = t - lastT
-    fullPath = backupPath + "/" + d
     if dryRun:
-        print(d + ":")
-        print("    time  =", t.strftime("%Y-%m-%d %H:%M:%S"))
-        print("    age   = " + str(age.days) + "d " + str(age.seconds) + "s")
-        print("    delta = " + str(delta.days) + "d " + str(delta.seconds) + "s")
-    if age.days > 2 and delta.days < 1:
-        if dryRun == 0: shutil.rmtree(fullPath)
-        infoLog("removed " + fullPath)
-        continue
-    if age.days > 28 and delta.days < 7:
-        if dryRun == 0: shutil.rmtree(fullPath)
-        infoLog("removed " + fullPath)
-        continue
-    if age.days > 56 and delta.days < 28:
-        if dryRun == 0: shutil.rmtree(fullPath)
-        infoLog("removed " + fullPath)
-        continue
-    lastT = t
-
-# Check remaining disk space
-dfCmd = "df --block-size=1G " + backupPath + " | tail -1 | awk '{print $4}'"
-dfCmdTotal = "df --block-size=1G " + backupPath + " | tail -1 | awk '{print $2}'"
-freeSpace = int(popen(dfCmd).read())
-totalSpace = int(popen(dfCmdTotal).read())
-freePercent = freeSpace * 100 / totalSpace
-i = 0
-# Free-up disk space by deleting oldest backups
-while freePercent < FREE_PERCENT:
-    if i == 0:
-        print("available disk space: " + str(freeSpace) + " GB (" +
-              str(round(freePercent)) + "%)")
-        print("deleting old backups to free-up disk space:")
-    fullPath = backupPath + "/" + dirList[i]
-    if dryRun == 0:
-        shutil.rmtree(fullPath)
-        freeSpace = int(popen(dfCmd).read())
-        freePercent = freeSpace * 100 / totalSpace
-    else:
-        freeSpace += 5
-        freePercent = freeSpace * 100 / totalSpace
-    warningLog("removed oldest backup " + fullPath)
-    i = i + 1
-    if i >= 5: break
-    if i >= (len(dirList) - 1): break
-
-print("available disk space: " + str(freeSpace) + " GB (" +
-      str(round(freePercent)) + "%)")
-
-print("done")
+        print(f"{len(planner.names)} backups, {len(plan)} to be removed:")
+        for name, reason, size in plan:
+            print(f"    {name}  {reason:5s}  {(size or 0) / GB:8.2f} GB")
+
+    # Execute the plan, moving the backups to the trash
+    for name, reason, size in plan:
+        fullPath = os.path.join(backupPath, name)
+        if not dryRun:
+            try:
+                trash.move(backupPath, name)
+            except OSError as e:
+                warningLog(f"failed to move {fullPath} to the trash: {e}")
+                continue
+        if reason == REASON_RULE:
+            infoLog("removed " + fullPath)
+        else:
+            warningLog("removed oldest backup " + fullPath)
+
+    if index is not None:
+        if plan and not dryRun:
+            index.prune(backup_names(os.listdir(backupPath)))
+        index.close()
+
+    # A running deleter picks up the new entries, otherwise a new one is started
+    if not dryRun and trash.pending(backupPath) and not trash.busy(backupPath):
+        trash.spawn(backupPath, os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "backup-hdd.log"))
+        print("emptying the trash in the background")
+    if any(size for name, reason, size in plan):
+        free += sum(size or 0 for name, reason, size in plan)
+        print("estimated after deletion:")
+    print_space(free, total)
+
+    print("done")
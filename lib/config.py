@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# Parse the configuration file(s)
+#
+# Python counterpart of lib/config.sh, applies the same parsing rules to
+# etc/nastia-server.conf and etc/nastia-server.local so that Python scripts
+# can read the configuration without sourcing common.sh in a shell.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+
+
+# Current directory where this script is located
+dir = os.path.dirname(os.path.abspath(__file__))
+
+# Configuration file path without the .conf/.local extension
+CONFIG = os.path.join(dir, "..", "etc", "nastia-server")
+
+# Valid left hand side: variable name with optional array index
+_LHS = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)(?:\[(\d+)\])?$")
+
+# Variable references within double quotes: $NAME, ${NAME} and ${NAME[i]}
+_REF = re.compile(r"\\([\\$\"`])|\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([A-Za-z_][A-Za-z0-9_]*)(?:\[(\d+)\])?\})")
+
+
+class Config:
+    """
+    Configuration parameters parsed from the .conf and .local files.
+
+    Values are stored per index like bash arrays, a plain assignment sets
+    index 0. The CFG_ prefix is optional when looking up a parameter.
+    """
+    def __init__(self, config=None):
+        self._config = config if config is not None else CONFIG
+        self._key = None
+        self._values = {}
+        self.refresh()
+
+    # Re-parse the configuration files if they have changed, returns True if re-parsed
+    def refresh(self):
+        key = self._file_key()
+        if key == self._key:
+            return False
+        values = {}
+        # Main server configuration file
+        self._parse(self._config + ".conf", values)
+        # Local configuration file has priority
+        self._parse(self._config + ".local", values)
+        self._values = values
+        self._key = key
+        return True
+
+    # Scalar value, equivalent to $CFG_NAME in bash
+    def get(self, name, default=None):
+        value = self._values.get(self._name(name), {}).get(0)
+        return default if value is None else value
+
+    # Integer value, returns default if missing or invalid
+    def getint(self, name, default=None):
+        try:
+            return int(self.get(name))
+        except (TypeError, ValueError):
+            return default
+
+    # Array elements sorted by index, equivalent to ${!CFG_NAME[@]} and ${CFG_NAME[@]} in bash
+    def array(self, name):
+        return dict(sorted(self._values.get(self._name(name), {}).items()))
+
+    def __getitem__(self, name):
+        return self.get(name, "")
+
+    def __contains__(self, name):
+        return self._name(name) in self._values
+
+    # Configuration name without the CFG_ prefix
+    def _name(self, name):
+        return name[4:] if name.startswith("CFG_") else name
+
+    # Modification time, size and inode of the configuration files, same key as config.sh
+    def _file_key(self):
+        key = []
+        for path in (self._config + ".conf", self._config + ".local"):
+            try:
+                st = os.stat(path)
+                key.append((int(st.st_mtime), st.st_size, st.st_ino))
+            except OSError:
+                key.append(None)
+        return tuple(key)
+
+    # Configuration parser, same rules as parseConfig in config.sh
+    def _parse(self, path, values):
+        try:
+            with open(path, "r", errors="replace") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+
+        for line in lines:
+            # Equivalent to: IFS='= ' read -r lhs rhs
+            line = line.lstrip(" ")
+            match = re.match(r"^([^ =]*)(.*)$", line)
+            lhs, rhs = match.group(1), match.group(2).lstrip(" ")
+            if rhs.startswith("="):
+                rhs = rhs[1:].lstrip(" ")
+            rhs = rhs.rstrip(" ")
+
+            if not lhs or lhs.startswith("#"):
+                continue
+
+            rhs = rhs.split("#", 1)[0]     # Del in line right comments
+            rhs = rhs.rstrip(" ")          # Del trailing spaces
+            if '"' in rhs:
+                rhs = rhs[:rhs.rindex('"')]  # Del closing string quotes
+            if rhs.startswith('"'):
+                rhs = rhs[1:]              # Del opening string quotes
+
+            lhs_match = _LHS.match(lhs)
+            if not lhs_match:
+                continue
+            name = lhs_match.group(1)
+            index = int(lhs_match.group(2) or 0)
+            values.setdefault(name, {})[index] = self._expand(rhs, values)
+
+    # Expand variable references like bash does within double quotes
+    def _expand(self, text, values):
+        def replace(match):
+            if match.group(1):
+                return match.group(1)
+            name = match.group(2) or match.group(3)
+            index = int(match.group(4) or 0)
+            if name.startswith("CFG_") and name[4:] in values:
+                name = name[4:]
+            if name in values:
+                return values[name].get(index, "")
+            return os.environ.get(name, "") if index == 0 else ""
+        return _REF.sub(replace, text)
@@ -30,8 +30,7 @@ _LIB_DIR=$(dirname $(readlink -f "$BASH_SOURCE"))
 
 # Configuration parameters
 _CONFIG="$_LIB_DIR/../etc/nastia-server"
-_TEMP_FILE="/tmp/nastia-server-config"
-_LOCK="/tmp/config.lock"
+_CONFIG_CACHE="/tmp/nastia-server-config.$EUID"
 
 
 # Configuration parser function
@@ -51,26 +50,46 @@ function parseConfig {
         rhs="${rhs%"${rhs##*[^ ]}"}" # Del trailing spaces
         rhs="${rhs%\"*}"     # Del opening string quotes 
         rhs="${rhs#\"*}"     # Del closing string quotes 
-	echo "CFG_$lhs"="\"$rhs\"" >> "$_TEMP_FILE"
-	echo "$lhs"="\"$rhs\"" >> "$_TEMP_FILE"
+	echo "CFG_$lhs"="\"$rhs\""
+	echo "$lhs"="\"$rhs\""
       fi
     done < $file
   fi
 }
 
 
-semaphoreLock "$_LOCK" "b"
+# Compiled configuration cache
+# - Keyed on the modification time, size and inode of both configuration files;
+# - Rebuilt only when the key changes, then atomically renamed into place;
+# - One cache per user, only trusted if owned by the current user.
+function loadConfig {
+  local key header tmp
+  key=$(stat -L -c '%Y:%s:%i' "$_CONFIG.conf" "$_CONFIG.local" 2>/dev/null)
+  key="${key//$'\n'/ }"
 
-echo "" > "$_TEMP_FILE"
+  if [[ -f "$_CONFIG_CACHE" && -O "$_CONFIG_CACHE" ]]; then
+    read -r header < "$_CONFIG_CACHE"
+    if [[ "$header" == "# $key" ]]; then
+      source "$_CONFIG_CACHE"
+      return 0
+    fi
+  fi
 
-# Main server configuration file
-parseConfig "$_CONFIG.conf"
+  tmp=$(mktemp "$_CONFIG_CACHE.XXXXXX")
+  {
+    echo "# $key"
+    # Main server configuration file
+    parseConfig "$_CONFIG.conf"
+    # Local configuration file has priority
+    parseConfig "$_CONFIG.local"
+  } > "$tmp"
 
-# Local configuration file has priority
-parseConfig "$_CONFIG.local"
+  source "$tmp"
 
-source "$_TEMP_FILE"
+  if ! mv -f "$tmp" "$_CONFIG_CACHE" 2>/dev/null; then
+    rm -f "$tmp"
+  fi
+}
 
-rm "$_TEMP_FILE"
 
-semaphoreRelease "$_LOCK"
+loadConfig
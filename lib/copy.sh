@@ -98,9 +98,9 @@ function main {
   echo ""
   echo "$dir/$file:"
   if [[ -n "$HOST" ]]; then
-    rsync -aAXv --delete --itemize-changes --delete-excluded $options $dir/$file $HOST:$DESTINATION/$dir
+    "$_LIB_DIR/rsyncstream.py" -n "${LOG_PREFIX:-copy}" -- rsync -aAXv --delete --itemize-changes --delete-excluded $options $dir/$file $HOST:$DESTINATION/$dir
   else
-    rsync -aAXv --delete --itemize-changes --delete-excluded $options $dir/$file $DESTINATION/$dir
+    "$_LIB_DIR/rsyncstream.py" -n "${LOG_PREFIX:-copy}" -- rsync -aAXv --delete --itemize-changes --delete-excluded $options $dir/$file $DESTINATION/$dir
   fi
   local rv=$?
   if [[ $rv -ne 0 ]]; then
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# Fan control service
+#
+# Controls the CPU cooling fan over a GPIO pin, or optionally over a
+# hardware PWM channel, according to the CPU temperature. The fan is
+# started at FAN_TEMPERATURE and stopped once the temperature has dropped
+# FAN_HYSTERESIS degrees below it, so that it does not chatter around the
+# threshold. With PWM the duty cycle rises linearly from FAN_PWM_MIN_DUTY
+# to 100% between the stop temperature and FAN_TEMPERATURE_MAX.
+#
+# The temperature and the GPIO value are read through file descriptors
+# opened once at startup, no subprocesses are started. Only the state
+# changes of the fan are logged.
+#
+# Usage: fan.py
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import time
+import signal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+
+
+# CPU temperature in millidegrees Celsius, same as 'vcgencmd measure_temp'
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+# GPIO and PWM sysfs directories
+GPIO_DIR = "/sys/class/gpio"
+PWM_DIR = "/sys/class/pwm"
+
+# Default parameters
+HYSTERESIS = 5          # Degrees Celsius
+PWM_FREQUENCY = 25000   # Hz
+PWM_MIN_DUTY = 30       # Percent
+TEMPERATURE_MAX = 65    # Degrees Celsius, full duty cycle
+
+
+# Write a value to a sysfs attribute
+def write_attribute(path, value):
+    with open(path, "w") as f:
+        f.write(str(value))
+
+
+class GpioOutput:
+    """
+    Fan connected to a GPIO pin, the pin is exported and configured as an
+    output if needed. Any duty cycle above 0 turns the fan on.
+    """
+    def __init__(self, pin, directory=GPIO_DIR, log=print):
+        path = os.path.join(directory, f"gpio{pin}")
+        if not os.path.exists(path):
+            write_attribute(os.path.join(directory, "export"), pin)
+            log(f"initialized GPIO pin {pin}")
+        else:
+            log(f"GPIO pin {pin} already initialized")
+        with open(os.path.join(path, "direction")) as f:
+            direction = f.read().strip()
+        if direction != "out":
+            write_attribute(os.path.join(path, "direction"), "out")
+            log(f"GPIO pin {pin} direction set to 'out'")
+        else:
+            log(f"GPIO pin {pin} direction already set to 'out'")
+        self.name = f"GPIO pin {pin}"
+        self._fd = os.open(os.path.join(path, "value"), os.O_RDWR)
+
+    # Current duty cycle in percent, read from the pin
+    def duty(self):
+        return 100 if os.pread(self._fd, 8, 0).strip() == b"1" else 0
+
+    def set(self, duty):
+        os.pwrite(self._fd, b"1" if duty > 0 else b"0", 0)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PwmOutput:
+    """
+    Fan connected to a hardware PWM channel, the channel is exported and
+    enabled with the given frequency if needed.
+    """
+    def __init__(self, chip, channel, frequency=PWM_FREQUENCY, directory=PWM_DIR, log=print):
+        chip_path = os.path.join(directory, chip)
+        path = os.path.join(chip_path, f"pwm{channel}")
+        if not os.path.exists(path):
+            write_attribute(os.path.join(chip_path, "export"), channel)
+            log(f"initialized PWM channel {chip}/pwm{channel}")
+        self.name = f"PWM channel {chip}/pwm{channel}"
+        self.period = 1000000000 // frequency
+        write_attribute(os.path.join(path, "period"), self.period)
+        write_attribute(os.path.join(path, "enable"), 1)
+        self._fd = os.open(os.path.join(path, "duty_cycle"), os.O_RDWR)
+
+    # Current duty cycle in percent
+    def duty(self):
+        return round(int(os.pread(self._fd, 16, 0)) * 100 / self.period)
+
+    def set(self, duty):
+        os.pwrite(self._fd, str(self.period * duty // 100).encode(), 0)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class FanController:
+    """
+    Hysteresis control of a fan output.
+
+    output:      GpioOutput or PwmOutput
+    threshold:   temperature starting the fan
+    hysteresis:  the fan stops at threshold - hysteresis
+    pwm:         True to scale the duty cycle between min_duty and 100%,
+                 reached at max_temperature
+    thermal:     CPU temperature sysfs attribute
+    """
+    def __init__(self, output, threshold, hysteresis=HYSTERESIS, pwm=False,
+                 min_duty=PWM_MIN_DUTY, max_temperature=TEMPERATURE_MAX, thermal=THERMAL_ZONE):
+        self.output = output
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.pwm = pwm
+        self.min_duty = min_duty
+        self.max_temperature = max(max_temperature, threshold)
+        self._thermal = os.open(thermal, os.O_RDONLY)
+
+    def close(self):
+        os.close(self._thermal)
+        self.output.close()
+
+    # CPU temperature in degrees Celsius
+    def temperature(self):
+        return int(os.pread(self._thermal, 16, 0)) / 1000
+
+    # Duty cycle in percent for the given temperature while the fan is running
+    def running_duty(self, temperature):
+        if not self.pwm:
+            return 100
+        low = self.threshold - self.hysteresis
+        ratio = (temperature - low) / max(self.max_temperature - low, 1)
+        return max(self.min_duty, min(100, round(self.min_duty + (100 - self.min_duty) * ratio)))
+
+    # Read the temperature and update the output, returns the temperature and
+    # "start" or "stop" if the fan state has changed, otherwise None
+    def step(self):
+        temperature = self.temperature()
+        duty = self.output.duty()
+        running = duty > 0
+        change = None
+        if not running and temperature >= self.threshold:
+            change = "start"
+            running = True
+        elif running and temperature < self.threshold - self.hysteresis:
+            change = "stop"
+            running = False
+        new = self.running_duty(temperature) if running else 0
+        if new != duty:
+            self.output.set(new)
+        return temperature, change
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    config = Config()
+    info = NLog("fan", mode="ed+")
+    warning = NLog("fan", mode="ecd")
+
+    # Print an error message and exit
+    def errorLog(text):
+        warning.error(text)
+        warning.close()
+        info.close()
+        sys.exit(1)
+
+    # Exit normally on SIGTERM so that the log messages get written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    info.info("fan control service started")
+    pwm = config["FAN_PWM"].split()
+    try:
+        if pwm:
+            output = PwmOutput(pwm[0], int(pwm[1]) if len(pwm) > 1 else 0,
+                               config.getint("FAN_PWM_FREQUENCY", PWM_FREQUENCY), log=info.info)
+        else:
+            output = GpioOutput(config.getint("FAN_GPIO_PIN"), log=info.info)
+    except (OSError, ValueError) as e:
+        errorLog(f"failed to initialize the fan output: {e}")
+
+    try:
+        controller = FanController(output, config.getint("FAN_TEMPERATURE"), config.getint("FAN_HYSTERESIS", HYSTERESIS),
+                                   bool(pwm), config.getint("FAN_PWM_MIN_DUTY", PWM_MIN_DUTY),
+                                   config.getint("FAN_TEMPERATURE_MAX", TEMPERATURE_MAX))
+    except OSError as e:
+        errorLog(f"failed to open {THERMAL_ZONE}: {e}")
+
+    # Periodically poll the CPU temperature
+    interval = config.getint("FAN_INTERVAL", 5)
+    try:
+        while True:
+            try:
+                temperature, change = controller.step()
+            except (OSError, ValueError) as e:
+                errorLog(f"failed to control the fan over {output.name}: {e}")
+            if change == "start":
+                info.info(f"start ({int(temperature)}'C)")
+            elif change == "stop":
+                info.info(f"stop  ({int(temperature)}'C)")
+            time.sleep(interval)
+    finally:
+        info.close()
+        warning.close()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Incremental reader of the common info, warning and error logs
+#
+# The common logs (INFO_LOG, WARNING_LOG and ERROR_LOG) are appended to by
+# every script through lib/log.sh and lib/nlog.py. Instead of re-reading
+# them for every report, the byte offset and inode reached in each log are
+# persisted together with the messages read so far, so that only the lines
+# appended since the previous scan are parsed. The messages are aggregated
+# into per-prefix counters and deduplicated messages with their first and
+# last time stamps.
+#
+# A log that has been renamed by logrotate is read up to its end from
+# <log>.1 before its successor is read from the start. A log that has been
+# truncated in place, i.e. that is shorter than the offset or whose first
+# bytes have changed, is read again from the start.
+#
+# The aggregated messages are kept until they are acknowledged, monitor
+# acknowledges them once its report has been sent.
+#
+# Usage:
+#   logscan.py report LOG        Print the messages logged since the last acknowledgement
+#   logscan.py prefixes LOG...   Print the prefixes seen since the last acknowledgement
+#   logscan.py ack LOG...        Acknowledge the messages read so far
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import json
+import fcntl
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+
+
+# Log line as written by log.sh and nlog.py: "<stamp>: [<prefix>] <text>"
+LOG_LINE = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(?: [A-Z0-9+-]+)?): ?(?:\[([^\]]+)\] )?(.*)$")
+
+# Name of the state directory within TMP_DIR
+STATE_DIR = "logscan"
+
+# Maximum number of distinct messages kept per log, further ones are only counted
+MAX_MESSAGES = 1000
+
+# Read size in bytes
+CHUNK_SIZE = 1024 * 1024
+
+# Number of leading bytes identifying the content of a log
+HEAD_SIZE = 64
+
+
+class LogScanner:
+    """
+    Incremental reader of a single log file.
+
+    path:  log file
+    state: JSON file holding the read position and the aggregated messages
+    """
+    def __init__(self, path, state):
+        self.path = path
+        self.state_path = state
+        self._lock = None
+        self.inode = None
+        self.offset = 0
+        self.head = ""       # Leading bytes of the log
+        self.prefixes = {}   # Prefix: [count, last time stamp]
+        self.messages = {}   # Prefix and text: [count, first time stamp, last time stamp]
+        self.dropped = 0     # Messages not kept because of MAX_MESSAGES
+
+    # Lock and load the state, the lock is held until close()
+    def open(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        self._lock = open(self.state_path + ".lock", "a")
+        fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return self
+        self.inode = state.get("inode")
+        self.offset = state.get("offset", 0)
+        self.head = state.get("head", "")
+        self.prefixes = state.get("prefixes", {})
+        self.messages = {tuple(json.loads(k)): v for k, v in state.get("messages", {}).items()}
+        self.dropped = state.get("dropped", 0)
+        return self
+
+    # Save the state and release the lock
+    def close(self):
+        state = {
+            "inode": self.inode,
+            "offset": self.offset,
+            "head": self.head,
+            "prefixes": self.prefixes,
+            "messages": {json.dumps(k): v for k, v in self.messages.items()},
+            "dropped": self.dropped,
+        }
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+        self._lock.close()
+        self._lock = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Read the lines appended since the previous scan, returns the number of lines
+    def scan(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        count = 0
+        if st.st_ino != self.inode:
+            # Finish reading the previous log if it has been rotated
+            try:
+                rotated = os.stat(self.path + ".1")
+                if rotated.st_ino == self.inode:
+                    count += self._read(self.path + ".1", self.offset)
+            except FileNotFoundError:
+                pass
+            self.inode = st.st_ino
+            self.offset = 0
+            self.head = ""
+        elif st.st_size < self.offset or self._head(self.path, len(self.head)) != self.head:
+            # Truncated in place
+            self.offset = 0
+            self.head = ""
+        if st.st_size > self.offset:
+            count += self._read(self.path, self.offset)
+        if len(self.head) < HEAD_SIZE:
+            self.head = self._head(self.path, min(self.offset, HEAD_SIZE))
+        return count
+
+    # Leading bytes of a file
+    @staticmethod
+    def _head(path, size):
+        with open(path, "rb") as f:
+            return f.read(size).decode("latin-1")
+
+    # Parse the complete lines of a file starting at offset
+    def _read(self, path, offset):
+        count = 0
+        last = None
+        rest = b""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines = (rest + chunk).split(b"\n")
+                rest = lines.pop()
+                for line in lines:
+                    last = self._add(line.decode(errors="replace"), last)
+                    count += 1
+                offset += len(chunk)
+        if last is not None:
+            self._commit(last)
+        # An incomplete last line is read again by the next scan
+        if path == self.path:
+            self.offset = offset - len(rest)
+        return count
+
+    # Parse a line, lines without a time stamp continue the previous message.
+    # Returns the pending message as a [stamp, prefix, text] list.
+    def _add(self, line, pending):
+        match = LOG_LINE.match(line)
+        if match is None:
+            if pending is not None:
+                pending[2] += "\n" + line
+            return pending
+        if pending is not None:
+            self._commit(pending)
+        stamp, prefix, text = match.groups()
+        return [stamp, prefix or "", text]
+
+    # Add a complete message to the counters
+    def _commit(self, message):
+        stamp, prefix, text = message
+        counter = self.prefixes.setdefault(prefix, [0, stamp])
+        counter[0] += 1
+        counter[1] = stamp
+        key = (prefix, text)
+        entry = self.messages.get(key)
+        if entry is not None:
+            entry[0] += 1
+            entry[2] = stamp
+        elif len(self.messages) < MAX_MESSAGES:
+            self.messages[key] = [1, stamp, stamp]
+        else:
+            self.dropped += 1
+
+    # Forget the messages read so far, the read position is kept
+    def acknowledge(self):
+        self.prefixes = {}
+        self.messages = {}
+        self.dropped = 0
+
+    # Report lines sorted by first time stamp, repeated messages on a single line
+    def report(self):
+        lines = []
+        for (prefix, text), (count, first, last) in sorted(self.messages.items(), key=lambda item: item[1][1]):
+            prefix = f" [{prefix}]" if prefix else ""
+            if count == 1:
+                lines.append(f"{first}:{prefix} {text}")
+            else:
+                lines.append(f"{first} .. {last} ({count}x):{prefix} {text}")
+        if self.dropped:
+            lines.append(f"({self.dropped} more messages)")
+        return lines
+
+
+# State file of a log
+def state_path(config, log):
+    return os.path.join(config.get("TMP_DIR", "/var/tmp"), STATE_DIR, os.path.basename(log) + ".json")
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="Incremental reader of the common info, warning and error logs"
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    parser_report = subparsers.add_parser("report", help="Print the messages logged since the last acknowledgement")
+    parser_report.add_argument("log")
+
+    parser_prefixes = subparsers.add_parser("prefixes", help="Print the prefixes seen since the last acknowledgement")
+    parser_prefixes.add_argument("log", nargs="+")
+
+    parser_ack = subparsers.add_parser("ack", help="Acknowledge the messages read so far")
+    parser_ack.add_argument("log", nargs="+")
+
+    args = parser.parse_args()
+
+    config = Config()
+    logs = [args.log] if args.action == "report" else args.log
+    prefixes = {}
+    try:
+        for log in logs:
+            with LogScanner(log, state_path(config, log)) as scanner:
+                if args.action == "ack":
+                    scanner.acknowledge()
+                    continue
+                scanner.scan()
+                if args.action == "report":
+                    for line in scanner.report():
+                        print(line)
+                for prefix, (count, last) in scanner.prefixes.items():
+                    total = prefixes.setdefault(prefix, [0, last])
+                    total[0] += count
+                    total[1] = max(total[1], last)
+    except OSError as e:
+        print(f"Failed to read {e.filename}: {e.strerror}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.action == "prefixes":
+        for prefix, (count, last) in sorted(prefixes.items()):
+            if prefix:
+                print(f"{prefix} {count} {last}")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# Content hash index of a media library
+#
+# SQLite database mapping the size and content hashes of the files within
+# one or more library trees to their paths. Used by photostream for finding
+# byte-identical duplicates and name-similar candidates without searching
+# the whole library tree for every incoming file.
+#
+# Each file is indexed by its size and a partial hash of its first and last
+# 64 KiB. The full content hash is only computed when two files share the
+# same size and partial hash. Images may additionally be indexed by their
+# perceptual hash for finding near-duplicates (see lib/phash.py).
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import sqlite3
+import hashlib
+from multiprocessing import Pool
+
+from lib import phash
+
+
+# Number of bytes hashed at the beginning and end of a file for the partial hash
+PARTIAL_SIZE = 65536
+
+# Read buffer size for the full hash
+CHUNK_SIZE = 1024 * 1024
+
+# Directories excluded from the index, same as the duplicate search in photostream
+EXCLUDE_DIRS = ("Inbox", ".sync")
+
+# Number of images per perceptual hash batch
+PHASH_BATCH = 64
+
+# Perceptual hash value of images that could not be decoded
+NO_PHASH = -2**63
+
+# Highest code point, upper bound for prefix range queries
+_MAX_CHAR = chr(0x10ffff)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path    TEXT PRIMARY KEY,
+    name    TEXT NOT NULL,
+    size    INTEGER NOT NULL,
+    mtime   INTEGER NOT NULL,
+    partial BLOB NOT NULL,
+    full    BLOB,
+    phash   INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (size, partial);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+"""
+
+
+# Partial content hash of a file, returns None if the file cannot be read
+def partial_hash(path, size=None):
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size if size is None else size
+            h = hashlib.blake2b(digest_size=16)
+            h.update(f.read(PARTIAL_SIZE))
+            if size > 2 * PARTIAL_SIZE:
+                f.seek(-PARTIAL_SIZE, os.SEEK_END)
+                h.update(f.read(PARTIAL_SIZE))
+            elif size > PARTIAL_SIZE:
+                h.update(f.read())
+            return h.digest()
+    except OSError:
+        return None
+
+
+# Full content hash of a file, returns None if the file cannot be read
+def full_hash(path):
+    try:
+        with open(path, "rb") as f:
+            h = hashlib.blake2b(digest_size=16)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+            return h.digest()
+    except OSError:
+        return None
+
+
+# Index entry of a file, returns None if the file cannot be read
+def _entry(path, partial=None):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if partial is None:
+        partial = partial_hash(path, st.st_size)
+    if partial is None:
+        return None
+    return (path, os.path.basename(path), st.st_size, int(st.st_mtime), partial)
+
+
+# Perceptual hashes of a batch of images as (path, signed hash) tuples, runs on the worker pool
+def _phash_batch(paths):
+    return [(p, NO_PHASH if h is None else _signed(h)) for p, h in zip(paths, phash.dhash_batch(paths))]
+
+
+# 64-bit hash as a signed SQLite integer and back
+def _signed(h):
+    return h - 2**64 if h >= 2**63 else h
+
+def _unsigned(h):
+    return h + 2**64 if h < 0 else h
+
+
+# Range of paths below a root directory for range queries
+def _subtree(root):
+    prefix = os.path.join(os.path.abspath(root), "")
+    return prefix, prefix + _MAX_CHAR
+
+
+class MediaIndex:
+    """
+    Content hash index stored in the SQLite database at path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        # Add the columns missing in databases created by older versions
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(files)")]
+        if "phash" not in columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN phash INTEGER")
+
+    def close(self):
+        self.db.close()
+
+    # Add or update a file, partial and hash are its partial and perceptual hash if already known
+    def add(self, path, partial=None, hash=None):
+        entry = _entry(os.path.abspath(path), partial)
+        if entry is None:
+            return False
+        hash = None if hash is None else _signed(hash)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (path, name, size, mtime, partial, phash) VALUES (?, ?, ?, ?, ?, ?)",
+                            entry + (hash,))
+        return True
+
+    # Remove a file
+    def remove(self, path):
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+
+    # Path of a byte-identical copy of the given file below root, or None.
+    # partial is the partial hash of the file if already known.
+    def lookup(self, path, root, partial=None):
+        path = os.path.abspath(path)
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+        low, high = _subtree(root)
+        rows = self.db.execute("SELECT path, mtime, full FROM files WHERE size = ? AND path >= ? AND path < ?",
+                               (size, low, high)).fetchall()
+        rows = [row for row in rows if row[0] != path]
+        if not rows:
+            return None
+
+        if partial is None:
+            partial = partial_hash(path, size)
+        rows = self.db.execute("SELECT path, mtime, full FROM files WHERE size = ? AND partial = ? AND path >= ? AND path < ?",
+                               (size, partial, low, high)).fetchall()
+        full = None
+        for candidate, mtime, candidate_full in rows:
+            if candidate == path:
+                continue
+            # Drop entries of files that have been deleted or modified
+            try:
+                st = os.stat(candidate)
+            except FileNotFoundError:
+                self.remove(candidate)
+                continue
+            if st.st_size != size or int(st.st_mtime) != mtime:
+                self.add(candidate)
+                continue
+            if candidate_full is None:
+                candidate_full = full_hash(candidate)
+                with self.db:
+                    self.db.execute("UPDATE files SET full = ? WHERE path = ?", (candidate_full, candidate))
+            if full is None:
+                full = full_hash(path)
+            if full is not None and full == candidate_full:
+                return candidate
+        return None
+
+    # Paths below root whose file name starts with one of the given prefixes
+    def candidates(self, root, prefixes):
+        low, high = _subtree(root)
+        result = []
+        for prefix in prefixes:
+            if not prefix:
+                continue
+            rows = self.db.execute("SELECT path FROM files WHERE name >= ? AND name < ? AND path >= ? AND path < ?",
+                                   (prefix, prefix + _MAX_CHAR, low, high))
+            result += [row[0] for row in rows if row[0] not in result and os.path.exists(row[0])]
+        return result
+
+    # True if any file below root has been indexed
+    def indexed(self, root):
+        low, high = _subtree(os.path.abspath(root))
+        return self.db.execute("SELECT 1 FROM files WHERE path >= ? AND path < ? LIMIT 1", (low, high)).fetchone() is not None
+
+    # Synchronize the index with the files below root, hashing new and modified
+    # files on a process pool. If full is True, all files are hashed again.
+    # Returns the number of (added, removed) entries.
+    def update(self, root, full=False, workers=None):
+        root = os.path.abspath(root)
+        low, high = _subtree(root)
+        indexed = {}
+        if not full:
+            indexed = dict(((path, (size, mtime)) for path, size, mtime in
+                            self.db.execute("SELECT path, size, mtime FROM files WHERE path >= ? AND path < ?", (low, high))))
+
+        found = set()
+        changed = []
+        for path, st in _walk(root):
+            found.add(path)
+            if indexed.get(path) != (st.st_size, int(st.st_mtime)):
+                changed.append(path)
+
+        removed = [path for path in indexed if path not in found]
+        entries = []
+        if changed:
+            with Pool(workers or os.cpu_count()) as pool:
+                entries = [e for e in pool.imap_unordered(_entry, changed, chunksize=64) if e is not None]
+
+        with self.db:
+            if full:
+                self.db.execute("DELETE FROM files WHERE path >= ? AND path < ?", (low, high))
+            self.db.executemany("DELETE FROM files WHERE path = ?", ((path,) for path in removed))
+            self.db.executemany("INSERT OR REPLACE INTO files (path, name, size, mtime, partial) VALUES (?, ?, ?, ?, ?)", entries)
+        return len(entries), len(removed)
+
+    # Compute the missing perceptual hashes of the images below root on a process pool,
+    # returns the number of images hashed
+    def update_phash(self, root, workers=None):
+        if not phash.available:
+            return 0
+        low, high = _subtree(root)
+        paths = [row[0] for row in self.db.execute("SELECT path FROM files WHERE phash IS NULL AND path >= ? AND path < ?", (low, high))
+                 if row[0].lower().endswith(phash.EXTENSIONS)]
+        if not paths:
+            return 0
+        batches = [paths[i:i + PHASH_BATCH] for i in range(0, len(paths), PHASH_BATCH)]
+        with Pool(workers or os.cpu_count()) as pool:
+            for result in pool.imap_unordered(_phash_batch, batches):
+                with self.db:
+                    self.db.executemany("UPDATE files SET phash = ? WHERE path = ?", ((h, p) for p, h in result))
+        return len(paths)
+
+    # BK-tree of the perceptual hashes of the images below root
+    def phash_tree(self, root):
+        low, high = _subtree(root)
+        tree = phash.BKTree()
+        for path, h in self.db.execute("SELECT path, phash FROM files WHERE phash IS NOT NULL AND phash != ? AND path >= ? AND path < ?",
+                                       (NO_PHASH, low, high)):
+            tree.add(_unsigned(h), path)
+        return tree
+
+
+# Regular files below root, excluding EXCLUDE_DIRS, as (path, stat) tuples
+def _walk(root):
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print(f"Failed to read {directory}: {e}", file=sys.stderr)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in EXCLUDE_DIRS:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#
+# System metrics collector
+#
+# Samples the CPU temperature, the load average and the fan GPIO state
+# every METRICS_INTERVAL seconds and the free space of the MONITOR_DISK
+# mount points every METRICS_DISK_INTERVAL seconds. All values are read
+# from /proc and /sys or with statvfs, no subprocesses are started. The
+# samples are stored in binary time-series stores (see lib/tsstore.py)
+# below METRICS_DIR, older than METRICS_RETENTION days are deleted.
+#
+# The UPS measurements are sampled by the UPS service into its own store
+# (UPS_MEAS_DIR), the collector only reads them.
+#
+# The latest values are served in the Prometheus text format on
+# http://127.0.0.1:METRICS_PORT/metrics. The min/mean/max of the last
+# hours are printed by the summary command, used by monitor.
+#
+# Usage:
+#   metrics.py run                Run the collector
+#   metrics.py summary [-H HOURS] Print min, mean and max of the last HOURS (default: 24)
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import math
+import time
+import signal
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+from lib import upsmeas
+from lib.tsstore import TimeSeriesStore, ROLLUP
+
+
+# Columns of the system store
+SYSTEM_COLUMNS = ("temperature", "load1", "load5", "load15", "fan")
+
+# Columns of the per-disk stores, in GB
+DISK_COLUMNS = ("free", "size")
+
+# CPU temperature in millidegrees Celsius, same as 'vcgencmd measure_temp'
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+# Default sampling intervals in seconds
+INTERVAL = 10
+DISK_INTERVAL = 300
+
+# UPS measurements older than this many seconds are not served
+UPS_MAX_AGE = 300
+
+GB = 1024 ** 3
+
+
+# Read a number from a /sys file, returns NaN if unavailable
+def read_number(path, scale=1):
+    try:
+        with open(path) as f:
+            return int(f.read().strip()) / scale
+    except (OSError, ValueError):
+        return math.nan
+
+
+# Store name of a disk mount point
+def disk_name(mount):
+    return "disk-" + (mount.strip("/").replace("/", "-") or "root")
+
+
+class Collector:
+    """
+    Samples the system metrics into the stores below directory.
+
+    disks:     mount points whose free space is sampled
+    fan_pin:   GPIO pin of the fan, None if there is no fan
+    retention: number of days to keep
+    ups:       UPS measurement store, whose latest values are served
+    """
+    def __init__(self, directory, disks, fan_pin=None, retention=None, ups=None):
+        self.disks = list(disks)
+        self.fan = f"/sys/class/gpio/gpio{fan_pin}/value" if fan_pin else None
+        self.system = TimeSeriesStore(os.path.join(directory, "system"), SYSTEM_COLUMNS, retention)
+        self.disk_stores = {d: TimeSeriesStore(os.path.join(directory, disk_name(d)), DISK_COLUMNS, retention)
+                            for d in self.disks}
+        self.ups = ups
+        self.latest = {}   # Store: (timestamp, values)
+        self._mutex = threading.Lock()
+
+    # Sample the CPU temperature, load average and fan state
+    def sample_system(self):
+        now = int(time.time())
+        values = [read_number(THERMAL_ZONE, 1000)] + list(os.getloadavg())
+        values.append(read_number(self.fan) if self.fan else math.nan)
+        self.system.append(now, values)
+        with self._mutex:
+            self.latest[self.system] = (now, values)
+
+    # Sample the free space of the mounted disks
+    def sample_disks(self):
+        now = int(time.time())
+        for disk, store in self.disk_stores.items():
+            if not os.path.ismount(disk):
+                continue
+            try:
+                st = os.statvfs(disk)
+            except OSError:
+                continue
+            values = [st.f_bavail * st.f_frsize / GB, st.f_blocks * st.f_frsize / GB]
+            store.append(now, values)
+            with self._mutex:
+                self.latest[store] = (now, values)
+
+    # Latest values in the Prometheus text format
+    def exposition(self):
+        with self._mutex:
+            latest = dict(self.latest)
+        lines = []
+
+        def gauge(name, help, samples):
+            samples = [(labels, value) for labels, value in samples if not math.isnan(value)]
+            if samples:
+                lines.append(f"# HELP nastia_{name} {help}")
+                lines.append(f"# TYPE nastia_{name} gauge")
+                for labels, value in samples:
+                    lines.append(f"nastia_{name}{labels} {value:.12g}")
+
+        if self.system in latest:
+            t, (temperature, load1, load5, load15, fan) = latest[self.system]
+            gauge("cpu_temperature_celsius", "CPU temperature", [("", temperature)])
+            gauge("load_average", "System load average",
+                  [('{period="1m"}', load1), ('{period="5m"}', load5), ('{period="15m"}', load15)])
+            gauge("fan_on", "Cooling fan state", [("", fan)])
+        disks = [(d, latest[s][1]) for d, s in self.disk_stores.items() if s in latest]
+        gauge("disk_free_bytes", "Available disk space", [(f'{{mount="{d}"}}', v[0] * GB) for d, v in disks])
+        gauge("disk_size_bytes", "Total disk space", [(f'{{mount="{d}"}}', v[1] * GB) for d, v in disks])
+        if self.ups is not None:
+            record = self.ups.latest()
+            if record is not None and time.time() - record[0] <= UPS_MAX_AGE:
+                gauge("ups", "UPS measurement", [(f'{{column="{c}"}}', v) for c, v in zip(upsmeas.COLUMNS, record[1])])
+        return "\n".join(lines) + "\n"
+
+    # Sample all stores at their intervals until stopped
+    def run(self, interval=INTERVAL, disk_interval=DISK_INTERVAL, stop=None):
+        stop = stop or threading.Event()
+        tasks = [[0, interval, self.sample_system], [0, disk_interval, self.sample_disks]]
+        while not stop.is_set():
+            now = time.monotonic()
+            for task in tasks:
+                if task[0] <= now:
+                    task[0] = now + task[1]
+                    try:
+                        task[2]()
+                    except OSError as e:
+                        print(f"Failed to store the samples: {e}", file=sys.stderr)
+            stop.wait(max(0, min(task[0] for task in tasks) - time.monotonic()))
+
+
+# HTTP request handler serving the collector's exposition
+class Handler(BaseHTTPRequestHandler):
+    collector = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.collector.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Do not log every request
+    def log_message(self, format, *args):
+        pass
+
+
+# Min, mean and max of each column of a store within the last hours,
+# returns a list of (column, min, mean, max) or an empty list
+def summarize(store, hours):
+    end = -(-int(time.time()) // ROLLUP) * ROLLUP   # Whole hours make use of the rollups
+    windows = store.query(end - hours * 3600, end, hours * 3600)
+    if not windows:
+        return []
+    w = windows[0]
+    return list(zip(store.columns, w.min, w.mean, w.max))
+
+
+# Summary lines for monitor: label, min, mean and max separated by tabs
+def summary(config, hours):
+    directory = config.get("METRICS_DIR") or os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "metrics")
+    labels = {
+        "temperature": "CPU temp. ('C)",
+        "load1": "Load average",
+        "fan": "Fan on (%)",
+    }
+    lines = []
+    for column, low, mean, high in summarize(TimeSeriesStore(os.path.join(directory, "system"), SYSTEM_COLUMNS), hours):
+        if column in labels and not math.isnan(mean):
+            scale = 100 if column == "fan" else 1
+            lines.append((labels[column], low * scale, mean * scale, high * scale))
+    for disk in config.array("MONITOR_DISK").values():
+        for column, low, mean, high in summarize(TimeSeriesStore(os.path.join(directory, disk_name(disk)), DISK_COLUMNS), hours):
+            if column == "free":
+                lines.append((f"{disk} free (GB)", low, mean, high))
+    for column, low, mean, high in summarize(upsmeas.open_store(config), hours):
+        lines.append((f"UPS {column}", low, mean, high))
+    return [f"{label}\t{low:.2f}\t{mean:.2f}\t{high:.2f}" for label, low, mean, high in lines]
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="System metrics collector"
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("run", help="Run the collector")
+    parser_summary = subparsers.add_parser("summary", help="Print min, mean and max of the last hours")
+    parser_summary.add_argument("-H", "--hours", type=int, default=24, help="Number of hours (default: 24)")
+    args = parser.parse_args()
+
+    config = Config()
+
+    if args.action == "summary":
+        for line in summary(config, args.hours):
+            print(line)
+        sys.exit(0)
+
+    nlog = NLog("metrics", mode="cd")
+    directory = config.get("METRICS_DIR") or os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "metrics")
+    collector = Collector(directory, config.array("MONITOR_DISK").values(), config.getint("FAN_GPIO_PIN"),
+                          config.getint("METRICS_RETENTION"), upsmeas.open_store(config))
+
+    # Exit normally on SIGTERM so that the log messages get written
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    port = config.getint("METRICS_PORT", 0)
+    if port:
+        Handler.collector = collector
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        except OSError as e:
+            nlog.warning(f"failed to serve the metrics on port {port}: {e}")
+
+    print("metrics collector started")
+    nlog.info("metrics collector started")
+    try:
+        collector.run(config.getint("METRICS_INTERVAL", INTERVAL), config.getint("METRICS_DISK_INTERVAL", DISK_INTERVAL), stop)
+    except KeyboardInterrupt:
+        pass
+    nlog.info("metrics collector stopped")
+    nlog.close()
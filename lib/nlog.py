@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Native Python logging backend
+#
+# Writes the same dedicated and common log lines as lib/log.sh without
+# forking a shell per message. Lines are buffered in memory and appended
+# under an exclusive fcntl lock. While the log semaphore is held (e.g. by
+# monitor while it collects the common logs) the lines are kept in the
+# buffer and written as soon as the semaphore is released.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import pwd
+import grp
+import time
+import fcntl
+import atexit
+import threading
+import weakref
+
+from lib.config import Config
+
+
+# Time and date stamp, same as LOG_STAMP_STR in log.sh
+STAMP_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+# Same as _SEMAPHORE_TIMEOUT in semaphore.sh, after this many seconds
+# a busy log semaphore is ignored
+SEMAPHORE_TIMEOUT = 600
+
+# Interval in seconds between attempts to lock a busy log semaphore
+RETRY_INTERVAL = 1
+
+# Maximum time in seconds to wait for a busy log semaphore on exit
+EXIT_TIMEOUT = 5
+
+
+# All logger instances, flushed on exit
+_instances = weakref.WeakSet()
+
+# Configuration parameters, shared by all logger instances
+_config = None
+
+
+# Read the configuration parameters required for logging
+def _read_config():
+    global _config
+    if _config is None:
+        _config = Config()
+    return _config
+
+
+class NLog:
+    """
+    Logger for a single log prefix, equivalent to calling _infoLog,
+    _warningLog and _errorLog from log.sh with the same prefix, log file
+    and mode arguments.
+
+    Mode flags are the same as in log.sh:
+      e: echo the message to stdout
+      d: append to the dedicated log file
+      c: append to the common info/warning/error log (used by monitor)
+      p: add the prefix to the dedicated log lines
+      +: do not lock the log semaphore
+
+    If flush_interval is greater than zero, lines are collected for up to
+    flush_interval seconds and written in a single append.
+    """
+    def __init__(self, prefix="", log=None, mode="cd", flush_interval=0):
+        config = _read_config()
+        self._prefix = prefix
+        self._mode = mode
+        self._flush_interval = flush_interval
+        if not log and prefix:
+            log = os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), f"{prefix}.log")
+        self._log = log
+        self._info_log = config["INFO_LOG"]
+        self._warning_log = config["WARNING_LOG"]
+        self._error_log = config["ERROR_LOG"]
+        self._user = config["USER"]
+        self._group = config["GROUP"]
+        self._semaphore = os.path.join(config.get("TMPFS_DIR", "/tmp"), "log-semaphore.lock")
+
+        self._pending = []         # List of (path, line, common) tuples
+        self._pending_since = None # Time when the oldest pending line was queued
+        self._busy_since = None    # Time when the log semaphore was first found busy
+        self._mutex = threading.RLock()
+        self._timer = None
+        _instances.add(self)
+
+    # Print an info message
+    def info(self, text):
+        self._print(text, self._info_log)
+
+    # Print a warning message
+    def warning(self, text):
+        self._print(f"[WARNING] {text}", self._warning_log)
+
+    # Print an error message
+    def error(self, text):
+        self._print(f"[ERROR] {text}", self._error_log)
+
+    # Format a log message and queue it for writing
+    def _print(self, text, clog):
+        prefix = f" [{self._prefix}]" if self._prefix else ""
+        dprefix = prefix if "p" in self._mode else ""
+        stamp = time.strftime(STAMP_FORMAT)
+
+        # Print an echo log message
+        if "e" in self._mode:
+            print(text)
+
+        with self._mutex:
+            # Queue a dedicated log message
+            if "d" in self._mode and self._log:
+                self._pending.append((self._log, f"{stamp}:{dprefix} {text}\n", False))
+
+            # Queue a common log message (used by monitor)
+            if "c" in self._mode and clog:
+                self._pending.append((clog, f"{stamp}:{prefix} {text}\n", True))
+
+            if not self._pending:
+                return
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+            if self._flush_interval > 0:
+                age = time.monotonic() - self._pending_since
+                if age < self._flush_interval:
+                    self._schedule(self._flush_interval - age)
+                    return
+
+            self.flush()
+
+    # Write all pending messages, returns False if they had to be deferred
+    def flush(self, force=False):
+        with self._mutex:
+            if not self._pending:
+                return True
+
+            locked = False
+            if "+" not in self._mode:
+                locked = self._semaphore_lock()
+                busy = self._busy_since is not None
+                if busy and not force:
+                    if time.monotonic() - self._busy_since < SEMAPHORE_TIMEOUT:
+                        self._schedule(RETRY_INTERVAL)
+                        return False
+
+            try:
+                self._write()
+            finally:
+                if locked:
+                    self._semaphore_release()
+            return True
+
+    # Append the pending lines to their log files
+    def _write(self):
+        files = {}
+        for path, line, common in self._pending:
+            files.setdefault((path, common), []).append(line)
+        self._pending = []
+        self._pending_since = None
+
+        for (path, common), lines in files.items():
+            try:
+                with open(path, "a") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        f.write("".join(lines))
+                        f.flush()
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            except OSError as e:
+                print(f"Failed to write {path}: {e}", file=sys.stderr)
+                continue
+            if common:
+                self._chown(path)
+
+    # Set the common log ownership like log.sh does
+    def _chown(self, path):
+        try:
+            uid = pwd.getpwnam(self._user).pw_uid if self._user else -1
+            gid = grp.getgrnam(self._group).gr_gid if self._group else -1
+            os.chown(path, uid, gid)
+        except (KeyError, OSError):
+            pass
+
+    # Lock the log semaphore without blocking
+    def _semaphore_lock(self):
+        try:
+            os.mkdir(self._semaphore)
+        except FileExistsError:
+            if self._busy_since is None:
+                self._busy_since = time.monotonic()
+            return False
+        except OSError:
+            # Semaphore directory unusable, log without locking like log.sh
+            self._busy_since = None
+            return False
+        self._busy_since = None
+        return True
+
+    # Release the log semaphore
+    def _semaphore_release(self):
+        try:
+            os.rmdir(self._semaphore)
+        except OSError:
+            pass
+
+    # Retry flushing after the given delay in seconds
+    def _schedule(self, delay):
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._mutex:
+            self._timer = None
+            self.flush()
+
+    # Flush pending messages on exit, waiting a bounded time for the semaphore
+    def close(self):
+        deadline = time.monotonic() + EXIT_TIMEOUT
+        while not self.flush() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.flush(force=True)
+
+
+@atexit.register
+def _flush_all():
+    for instance in list(_instances):
+        instance.close()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Perceptual image hash and Hamming distance search
+#
+# The difference hash (dHash) of an image is computed from an 9x8 grayscale
+# thumbnail: each of its 64 bits tells whether a pixel is brighter than its
+# right neighbour. Re-encoded, resized or slightly edited copies of an image
+# have hashes within a small Hamming distance of each other.
+#
+# JPEG files are decoded at reduced scale (Pillow draft mode) and the hashes
+# of a batch of images are computed with NumPy in a single vectorized step.
+#
+# Requires the following packages:
+# - python3-pil: for decoding the images
+# - python3-numpy: for computing the hashes
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+try:
+    import numpy
+    from PIL import Image
+    available = True
+except ImportError:
+    available = False
+
+
+# Hash size in bits per row and number of rows
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+
+# Image file extensions that can be hashed
+EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+# Grayscale thumbnail of an image as a (HASH_HEIGHT, HASH_WIDTH + 1) array, or None
+def thumbnail(path):
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (4 * (HASH_WIDTH + 1), 4 * HASH_HEIGHT))   # Decode JPEG at reduced scale
+            img = img.convert("L").resize((HASH_WIDTH + 1, HASH_HEIGHT), Image.BILINEAR)
+            return numpy.asarray(img, dtype=numpy.int16)
+    except Exception:
+        return None
+
+
+# Difference hashes of a list of images, returns a list of int or None per image
+def dhash_batch(paths):
+    thumbs = [thumbnail(p) for p in paths]
+    valid = [i for i, t in enumerate(thumbs) if t is not None]
+    result = [None] * len(paths)
+    if not valid:
+        return result
+    stack = numpy.stack([thumbs[i] for i in valid])
+    bits = stack[:, :, 1:] > stack[:, :, :-1]
+    packed = numpy.packbits(bits.reshape(len(valid), -1), axis=1)
+    hashes = packed.view(">u8").ravel()
+    for i, h in zip(valid, hashes):
+        result[i] = int(h)
+    return result
+
+
+# Difference hash of a single image, or None
+def dhash(path):
+    return dhash_batch([path])[0]
+
+
+# Number of differing bits
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree for Hamming distance search.
+
+    Each node holds a hash, the items with that hash and its children keyed
+    by their distance to the node. A search only descends into children
+    whose key is within the search radius of the distance to the node.
+    """
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    # Add an item with the given hash
+    def add(self, hash, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = distance(hash, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [hash, [item], {}]
+                return
+            node = child
+
+    # Items within radius of the given hash, as a list of (distance, item) sorted by distance
+    def search(self, hash, radius):
+        result = []
+        if self.root is None:
+            return result
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = distance(hash, node[0])
+            if d <= radius:
+                result += [(d, item) for item in node[1]]
+            for key, child in node[2].items():
+                if d - radius <= key <= d + radius:
+                    stack.append(child)
+        result.sort(key=lambda x: x[0])
+        return result
+
+    def __len__(self):
+        return self.size
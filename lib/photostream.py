@@ -0,0 +1,685 @@
+#!/usr/bin/env python
+#
+# Batch script for auto-organizing pictures and movies
+#
+# Renames media files according to jpeg exif or modification date
+# then moves them into pre-defined directories.
+# Per-date sub-directories are generated on the fly.
+# Duplicates are automatically detected and moved into a separate folder.
+# A backup copy of the media files may be kept in a separate folder.
+#
+# Processes each source directory as a batch: file name dates and EXIF
+# dates are extracted for all files at once, JPEG EXIF headers are parsed
+# natively and all other files, as well as JPEGs without an EXIF date that
+# may still carry an XMP or IPTC date, go through a single persistent
+# exiftool session. EXIF parsing and hashing run on a process pool, backup copies
+# on a thread pool.
+#
+# If MEDIA_PHASH_DISTANCE is set, images without an exact duplicate are
+# checked for near-duplicates (re-encoded, resized or slightly edited
+# copies) by searching the perceptual hashes of the library within that
+# distance.
+#
+# Uses the following optional packages:
+# - libimage-exiftool-perl: for parsing exif information of non-JPEG files
+# - imagemagick: for comparing duplicate images
+# - python3-pil, python3-numpy: for finding near-duplicate images
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import fcntl
+import shutil
+import struct
+import argparse
+import subprocess
+from fnmatch import fnmatchcase
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+from lib.nlog import NLog
+from lib.mediaindex import MediaIndex, PHASH_BATCH, partial_hash
+from lib import phash
+
+
+BAK = "Backup"          # Name of the sub-directories containing image backups
+DUP = "Duplicates"      # Name of the sub-directories containing image duplicates
+NO_DATE = "No-Date"     # Name of the sub-directory for files without EXIF date
+
+# Known file name patterns
+PATTERNS = {
+    "image": ("*.jpg", "*.JPG", "*.jpeg", "*.JPEG", "*.png", "*.PNG"),
+    "movie": ("*.mov", "*.MOV", "*.mp4", "*.MP4"),
+    "audio": ("*.3gpp", "*.3GPP", "*.m4a", "*.M4A"),
+}
+
+# Target file name format
+NAME_FORMAT = "%Y-%m-%d-%H%M%S"
+
+# EXIF date format
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# File name date formats: Dropbox Camera Uploads "YYYY-MM-DD HH.MM.SS" and
+# photostream (this script's) format "YYYY-MM-DD-HHMMSS"
+NAME_DATES = (
+    re.compile(r"^([1-9]\d{3})-([0-1]\d)-([0-3]\d) ([0-2]\d)\.([0-5]\d)\.([0-5]\d).*\.[^.]{3}$"),
+    re.compile(r"^([1-9]\d{3})-([0-1]\d)-([0-3]\d)-([0-2]\d)([0-5]\d)([0-5]\d).*\.[^.]{3}$"),
+)
+
+# EXIF tags
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_CREATE_DATE = 0x9004
+
+# Results of the EXIF date extraction
+EXIF_OK = 0        # Date found
+EXIF_ERROR = 1     # Failed to parse the file
+EXIF_NO_TAG = 2    # No date tag found
+
+
+# Parse an EXIF date string, returns the local UNIX time or None
+def parse_exif_date(text):
+    try:
+        return int(time.mktime(time.strptime(text.strip().rstrip("\0")[:19], EXIF_DATE_FORMAT)))
+    except (ValueError, OverflowError):
+        return None
+
+
+# Date tags of the EXIF header of a JPEG file, returns a dictionary of
+# tag: string, or None if the file is not a JPEG file that can be parsed
+def jpeg_exif(path):
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xff:
+                return None
+            kind, length = marker[1], struct.unpack(">H", marker[2:])[0]
+            if kind == 0xda or kind == 0xd9:   # Start of scan or end of image, no EXIF header
+                return {}
+            segment = f.read(length - 2)
+            if kind == 0xe1 and segment.startswith(b"Exif\0\0"):
+                return _tiff_dates(segment[6:])
+
+
+# Date tags of a TIFF structure
+def _tiff_dates(tiff):
+    try:
+        order = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        result = {}
+
+        def entries(offset):
+            count = struct.unpack_from(order + "H", tiff, offset)[0]
+            for i in range(count):
+                yield struct.unpack_from(order + "HHII", tiff, offset + 2 + 12 * i)
+
+        def ascii(kind, count, value):
+            if kind != 2:
+                return None
+            if count <= 4:
+                return struct.pack(order + "I", value)[:count].decode(errors="replace")
+            return tiff[value:value + count].decode(errors="replace")
+
+        ifd0 = struct.unpack_from(order + "I", tiff, 4)[0]
+        for tag, kind, count, value in entries(ifd0):
+            if tag == TAG_EXIF_IFD:
+                for tag, kind, count, value in entries(value):
+                    if tag in (TAG_DATE_TIME_ORIGINAL, TAG_CREATE_DATE):
+                        text = ascii(kind, count, value)
+                        if text is not None:
+                            result[tag] = text
+        return result
+    except (KeyError, struct.error):
+        return None
+
+
+# Date encoded in the file name, returns the local UNIX time or None
+def name_date(path):
+    name = os.path.basename(path)
+    for pattern in NAME_DATES:
+        match = pattern.match(name)
+        if match:
+            try:
+                return int(time.mktime(tuple(int(g) for g in match.groups()) + (0, 0, -1)))
+            except (ValueError, OverflowError):
+                return None
+    return None
+
+
+# Inspect a file, runs on the worker pool. Returns a tuple of
+# (path, name date, EXIF status or None if exiftool is needed, EXIF date, partial hash)
+def probe(path):
+    status, date = None, None
+    if path.lower().endswith((".jpg", ".jpeg")):
+        try:
+            tags = jpeg_exif(path)
+        except OSError:
+            tags = None
+        if tags is not None:
+            # CreateDate takes precedence, like exiftool '-FileModifyDate<DateTimeOriginal' '-FileModifyDate<CreateDate'
+            for tag in (TAG_CREATE_DATE, TAG_DATE_TIME_ORIGINAL):
+                date = parse_exif_date(tags[tag]) if tag in tags else None
+                if date is not None:
+                    break
+            # Without an EXIF date, exiftool also looks for XMP and IPTC dates
+            status = EXIF_OK if date is not None else None
+    return path, name_date(path), status, date, partial_hash(path)
+
+
+class ExifTool:
+    """
+    Persistent exiftool session (-stay_open), started on first use.
+    """
+    def __init__(self):
+        self.proc = None
+        self.available = shutil.which("exiftool") is not None
+
+    # Run exiftool with the given arguments, returns its output
+    def execute(self, *args):
+        if self.proc is None:
+            self.proc = subprocess.Popen(["exiftool", "-stay_open", "True", "-@", "-"],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True)
+        self.proc.stdin.write("\n".join(args) + "\n-execute\n")
+        self.proc.stdin.flush()
+        output = []
+        for line in self.proc.stdout:
+            if line.rstrip() == "{ready}":
+                break
+            output.append(line)
+        return "".join(output)
+
+    # Date tags of a list of files, returns a dictionary of path: (status, date)
+    def dates(self, paths):
+        result = {}
+        if not paths:
+            return result
+        output = self.execute("-json", "-d", EXIF_DATE_FORMAT, "-DateTimeOriginal", "-CreateDate", *paths)
+        try:
+            items = json.loads(output) if output.strip() else []
+        except ValueError:
+            items = []
+        for item in items:
+            date = None
+            for tag in ("CreateDate", "DateTimeOriginal"):
+                if tag in item:
+                    date = parse_exif_date(str(item[tag]))
+                    if date is not None:
+                        break
+            result[item.get("SourceFile")] = (EXIF_OK if date is not None else EXIF_NO_TAG, date)
+        for path in paths:
+            result.setdefault(path, (EXIF_ERROR, None))
+        return result
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.write("-stay_open\nFalse\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+            self.proc = None
+
+
+class KilledException(Exception):
+    pass
+
+
+class PhotoStream:
+    """
+    Organizes the media files of the configured streams.
+
+    lock:    lock directory, deleting it stops the execution
+    index:    content hash index database for finding duplicates, or None
+    workers:  size of the worker pool
+    distance: maximum perceptual hash distance of near-duplicate images, or None
+    """
+    def __init__(self, log, lock, index=None, workers=None, distance=None):
+        self.log = log
+        self.lock = lock
+        self.index_path = index
+        self.index = None
+        self.distance = distance
+        self.tree = None
+        self.workers = workers or os.cpu_count()
+        self.nlog = NLog("photostream", log=log, mode="ec")
+        self.exiftool = ExifTool()
+        self.log_header = True
+        self.error_flag = False
+        self.compare_available = shutil.which("compare") is not None
+
+    # Print message to log file
+    def print_log(self, text):
+        try:
+            with open(self.log, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if self.log_header:
+                    f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S %Z')} - {os.getcwd()}:\n")
+                    self.log_header = False
+                f.write(f"    {text}\n")
+        except OSError as e:
+            print(f"Failed to write {self.log}: {e}", file=sys.stderr)
+
+    # Print info message to log file
+    def info_log(self, text):
+        self.print_log(text)
+        self.nlog.info(text)
+
+    # Print warning message to log file
+    def warning_log(self, text):
+        self.print_log(f"[WARNING] {text}")
+        self.nlog.warning(text)
+
+    # Print error message to log file
+    def error_log(self, text):
+        self.print_log(f"[ERROR] {text}")
+        self.nlog.error(text)
+        self.error_flag = True
+
+    # Stop the execution if the lock directory has been deleted
+    def check_lock(self):
+        if not os.path.exists(self.lock):
+            self.warning_log(f"KILLED DUE TO REMOVED {self.lock}")
+            print(f"KILLED DUE TO REMOVED {self.lock}")
+            raise KilledException()
+
+    # Create a new directory
+    def install_dir(self, path):
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            self.error_log(f"mkdir {path} failed: {e}")
+
+    # Unique destination path, appends an incremental index to duplicate names
+    def unique(self, dst, reserved=()):
+        if not os.path.exists(dst) and dst not in reserved:
+            return dst
+        base, ext = os.path.splitext(dst)
+        num = 1
+        while os.path.exists(f"{base}-{num}{ext}") or f"{base}-{num}{ext}" in reserved:
+            num += 1
+        return f"{base}-{num}{ext}"
+
+    # Move a file, append incremental index to duplicate names, returns the destination
+    def smart_move(self, src, dst):
+        dst = self.unique(dst)
+        print(f"{src} --> {dst} (mv)")
+        self.print_log(f"{src} --> {dst} (mv)")
+        try:
+            shutil.move(src, dst)
+        except OSError as e:
+            self.warning_log(f"mv returned {e}")
+        return dst
+
+    # Copy a file preserving its timestamps, runs on the copy thread pool
+    def copy(self, src, dst):
+        try:
+            shutil.copy2(src, dst)
+        except OSError as e:
+            return f"cp returned {e}"
+        return None
+
+    # Compare two images pixel by pixel, returns True if identical
+    def compare_images(self, src, dup):
+        print(f"comparing image: {src} <> {dup} ...")
+        if not self.compare_available:
+            return False
+        proc = subprocess.run(["compare", "-limit", "memory", "100mb", "-metric", "AE", src, dup, "/dev/null"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        result = proc.stderr.strip()
+        print(f"    compare returned: {proc.returncode}")
+        if proc.returncode > 1:
+            self.warning_log(f"compare tool returned {proc.returncode}: {src} ??? {dup}")
+        print(f"    compare result: {result}")
+        return result == "0"
+
+    # Find a duplicate of src in dst_dir, returns its path or None
+    def find_duplicate(self, src, name, dst_dir, partial):
+        ext = os.path.splitext(name)[1][1:]
+        if self.index is not None:
+            dup = self.index.lookup(src, dst_dir, partial)
+            if dup is not None or ext != "jpg":
+                return dup
+            candidates = self.index.candidates(dst_dir, [os.path.splitext(src)[0], os.path.splitext(name)[0]])
+        else:
+            candidates = self.find_candidates(dst_dir, [os.path.splitext(src)[0], os.path.splitext(name)[0]])
+        if candidates:
+            print("found potential duplicates:")
+            print("\n".join(candidates))
+        for dup in candidates:
+            if ext == "jpg":
+                if self.compare_images(src, dup):
+                    return dup
+            else:
+                print(f"comparing file: {src} <> {dup} ...")
+                if subprocess.run(["cmp", "-s", src, dup]).returncode == 0:
+                    return dup
+        return None
+
+    # Library image similar to src, returns a tuple of (distance, path) or None
+    def find_near_duplicate(self, src, hash):
+        if self.tree is None or hash is None:
+            return None
+        for d, dup in self.tree.search(hash, self.distance):
+            if os.path.exists(dup):
+                return d, dup
+        return None
+
+    # Perceptual hashes of the images among files, returns a dictionary of path: hash
+    def perceptual_hashes(self, files, pool):
+        images = [f for f in files if f.lower().endswith(phash.EXTENSIONS)]
+        print(f"hashing images: {len(images)} files ...")
+        batches = [images[i:i + PHASH_BATCH] for i in range(0, len(images), PHASH_BATCH)]
+        result = {}
+        for batch, hashes in zip(batches, pool.imap(phash.dhash_batch, batches)):
+            result.update(zip(batch, hashes))
+        return result
+
+    # Files in dst_dir starting with one of the prefixes, used without index
+    def find_candidates(self, dst_dir, prefixes):
+        result = []
+        for root, dirs, files in os.walk(dst_dir):
+            dirs[:] = [d for d in dirs if d not in ("Inbox", ".sync")]
+            for f in files:
+                if any(fnmatchcase(f, glob.escape(p) + "*") for p in prefixes):
+                    result.append(os.path.join(root, f))
+        return result
+
+    # Extract the dates of a batch of files and apply them to the modification times,
+    # returns a dictionary of path: (EXIF status, partial hash)
+    def extract_dates(self, files, pool):
+        result = {}
+        pending = []
+        for path, ndate, status, date, partial in pool.imap(probe, files, chunksize=16):
+            if ndate is not None:
+                print(f"extracting timestamp from file name: {path} ({time.strftime('%Y%m%d%H%M.%S', time.localtime(ndate))})")
+                self.set_mtime(path, ndate)
+            if status is None:
+                pending.append(path)
+            else:
+                self.apply_exif(path, status, date)
+            result[path] = [status, partial]
+
+        # Files that cannot be parsed natively go through a single exiftool call
+        if pending:
+            if self.exiftool.available:
+                print(f"parsing EXIF: {len(pending)} files ...")
+                dates = self.exiftool.dates(pending)
+            else:
+                dates = {path: (None, None) for path in pending}
+            for path in pending:
+                status, date = dates[path]
+                if status is None:
+                    self.error_log(f"exiftool not found: failed to parse {path}")
+                    status = EXIF_ERROR
+                elif status == EXIF_ERROR:
+                    self.error_log(f"exiftool failed to parse {path}")
+                self.apply_exif(path, status, date)
+                result[path][0] = status
+        return result
+
+    # Apply an EXIF date to the file modification time
+    def apply_exif(self, path, status, date):
+        if status == EXIF_OK:
+            self.set_mtime(path, date)
+        elif status == EXIF_NO_TAG:
+            self.print_log(f"EXIF TAG NOT FOUND: {path}")
+
+    # Set the modification time of a file
+    def set_mtime(self, path, timestamp):
+        try:
+            os.utime(path, (timestamp, timestamp))
+        except OSError as e:
+            self.error_log(f"touch failed while modifying {path}: {e}")
+
+    # Main processing routine
+    def process(self, kind, src_dir, dst_dir, backup, subfolder, out_ext):
+        self.log_header = True
+        copy_count = dup_count = no_date_count = err_count = 0
+
+        patterns = PATTERNS.get(kind)
+        if patterns is None:
+            self.error_log(f"invalid file type '{kind}'")
+            return
+
+        print(" ")
+        print(f"source:      {src_dir} ")
+        print(f"destination: {dst_dir} ")
+        print(f"backup:      {backup}  ")
+        print(f"subfolder:   {subfolder} ")
+        print(f"pattern:     {' '.join(patterns)} ")
+        print(f"extension:   {out_ext} ")
+
+        if not os.path.isdir(src_dir):
+            self.error_log(f"directory '{src_dir}' does not exist")
+            return
+        os.chdir(src_dir)
+
+        if not os.path.isdir(dst_dir):
+            self.error_log(f"directory '{dst_dir}' does not exist")
+            return
+
+        files = sorted(f for f in os.listdir(".") if os.path.isfile(f) and any(fnmatchcase(f, p) for p in patterns))
+        if not files:
+            print("done")
+            return
+
+        # The destination directory is only walked if it has not been indexed yet,
+        # afterwards the moved files are added as they are moved in
+        self.index = None
+        if self.index_path:
+            try:
+                index = MediaIndex(self.index_path)
+                if not index.indexed(dst_dir):
+                    added, removed = index.update(dst_dir, workers=self.workers)
+                    print(f"{dst_dir}: {added} added, {removed} removed")
+                self.index = index
+            except Exception as e:
+                self.warning_log(f"failed to update the index of {dst_dir}, searching for duplicates without index ({e})")
+
+        # Perceptual hashes of the library images for finding near-duplicates
+        self.tree = None
+        if self.distance is not None and self.index is not None and phash.available:
+            try:
+                hashed = self.index.update_phash(dst_dir, workers=self.workers)
+                self.tree = self.index.phash_tree(dst_dir)
+                print(f"{dst_dir}: {hashed} images hashed, {len(self.tree)} perceptual hashes")
+            except Exception as e:
+                self.warning_log(f"failed to load the perceptual hashes of {dst_dir}, skipping near-duplicate search ({e})")
+
+        print("renaming and moving files...")
+        with Pool(self.workers) as pool, ThreadPoolExecutor(max_workers=2) as copier:
+            probes = self.extract_dates(files, pool)
+            hashes = self.perceptual_hashes(files, pool) if self.tree is not None else {}
+            copies = []
+            reserved = set()
+
+            for file in files:
+                self.error_flag = False
+                self.check_lock()
+                status, partial = probes[file]
+                if status == EXIF_ERROR:
+                    self.error_flag = True
+
+                ext = (out_ext or os.path.splitext(file)[1][1:]).lower()
+                try:
+                    mtime = os.stat(file).st_mtime
+                except OSError as e:
+                    self.error_log(f"stat {file} failed: {e}")
+                    err_count += 1
+                    continue
+                name = time.strftime(NAME_FORMAT, time.localtime(mtime)) + "." + ext
+
+                hash = hashes.get(file)
+                dup = self.find_duplicate(file, name, dst_dir, partial)
+                if dup is not None:
+                    print(f"duplicate found: {file}")
+                    self.print_log(f"DUPLICATE FOUND: {file} == {dup}")
+                near = None if dup is not None else self.find_near_duplicate(file, hash)
+                if near is not None:
+                    print(f"near-duplicate found: {file}")
+                    self.print_log(f"NEAR-DUPLICATE FOUND: {file} ~= {near[1]} (distance {near[0]})")
+                if dup is not None or near is not None:
+                    self.install_dir(DUP)
+                    self.smart_move(file, os.path.join(DUP, file))
+                    if not self.error_flag:
+                        dup_count += 1
+                else:
+                    if status != EXIF_OK:
+                        dst_path = os.path.join(dst_dir, NO_DATE)
+                        no_date_count += 1
+                    elif subfolder:
+                        dst_path = os.path.join(dst_dir, name[0:7])
+                    else:
+                        dst_path = dst_dir
+                    self.install_dir(dst_path)
+                    dst = self.smart_move(file, os.path.join(dst_path, name))
+                    if self.index is not None:
+                        self.index.add(dst, partial, hash)
+                    if self.tree is not None and hash is not None:
+                        self.tree.add(hash, os.path.abspath(dst))
+
+                    # The backup copy is made from the moved file
+                    if backup:
+                        self.install_dir(BAK)
+                        bak = self.unique(os.path.join(BAK, name), reserved)
+                        reserved.add(bak)
+                        print(f"{dst} --> {bak} (cp)")
+                        self.print_log(f"{file} --> {bak} (cp)")
+                        copies.append(copier.submit(self.copy, dst, bak))
+                    if not self.error_flag:
+                        copy_count += 1
+                if self.error_flag:
+                    err_count += 1
+
+            for future in copies:
+                error = future.result()
+                if error is not None:
+                    self.warning_log(error)
+
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        self.tree = None
+
+        self.info_log(f"{src_dir} ({kind}): {copy_count} successful / {no_date_count} without EXIF / "
+                      f"{dup_count} duplicates / {err_count} errors")
+        print("done")
+
+    def close(self):
+        self.exiftool.close()
+
+
+# Semaphore lock, same as semaphoreLock in semaphore.sh
+def semaphore_lock(path):
+    try:
+        os.mkdir(path)
+        return True
+    except OSError:
+        return False
+
+
+# Semaphore release, same as semaphoreRelease in semaphore.sh
+def semaphore_release(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="Rename media files according to their date and move them into the library"
+    )
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the duplicate index of all destinations")
+    parser.add_argument("-s", "--stream", action="append", nargs="+", metavar="ARG",
+                        help="TYPE SRC DST BACKUP SUBFOLDER [EXT] relative to the media root, replaces MEDIA_STREAM")
+    parser.add_argument("-r", "--root", help="Media root directory (default: MEDIA_ROOT_DIR)")
+    parser.add_argument("-i", "--index", help="Index database (default: MEDIA_INDEX_DB)")
+    parser.add_argument("-l", "--lock", help="Lock directory (default: TMPFS_DIR/photostream.lock)")
+    parser.add_argument("-w", "--workers", type=int, help="Worker pool size (default: number of CPUs)")
+    args = parser.parse_args()
+
+    config = Config()
+    root = args.root or config["MEDIA_ROOT_DIR"]
+    log = os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "photostream.log")
+    lock = args.lock or os.path.join(config.get("TMPFS_DIR", "/tmp"), "photostream.lock")
+    index = args.index if args.index is not None else config["MEDIA_INDEX_DB"]
+    distance = config.getint("MEDIA_PHASH_DISTANCE")
+    streams = [s for s in args.stream] if args.stream else [v.split() for v in config.array("MEDIA_STREAM").values()]
+
+    photostream = PhotoStream(log, lock, index, args.workers, distance)
+
+    # Enforce a single instance of this script
+    if not semaphore_lock(lock):
+        photostream.warning_log(f"an instance of the current script is already running (please remove {lock})")
+        sys.exit(1)
+
+    print(" ")
+    print(" ")
+    print("##############################")
+    print("Updating photo stream")
+    print(time.strftime("%c"))
+    print("##############################")
+
+    rv = 0
+    try:
+        for stream in streams:
+            if not stream:
+                continue
+            stream = stream + [""] * (6 - len(stream))
+            kind = stream[0]
+            src = os.path.join(root, stream[1].replace("%", " "))  # Replace % with space
+            dst = os.path.join(root, stream[2].replace("%", " "))  # Replace % with space
+            if args.rebuild_index:
+                print(f"rebuilding the index of {dst} ...")
+                try:
+                    mi = MediaIndex(index)
+                    added, removed = mi.update(dst, full=True, workers=args.workers)
+                    hashed = mi.update_phash(dst, workers=args.workers)
+                    print(f"{dst}: {added} added, {removed} removed, {hashed} images hashed")
+                    mi.close()
+                except Exception as e:
+                    photostream.error_log(f"failed to rebuild the index of {dst}: {e}")
+            else:
+                photostream.process(kind, src, dst, stream[3] == "1", stream[4] == "1", stream[5])
+    except KilledException:
+        rv = 1
+    finally:
+        photostream.close()
+
+    if rv == 0:
+        semaphore_release(lock)
+    sys.exit(rv)
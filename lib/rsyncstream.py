@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+#
+# rsync output stream processor for the backup scripts
+#
+# Runs rsync with an itemized output format including the file sizes and
+# parses its output on the fly instead of logging every file: the number
+# of transferred files and bytes, deletions, throughput and the estimated
+# time left (based on the number of items of the previous run) are printed
+# as a compact progress line every PROGRESS_INTERVAL seconds. A JSON
+# summary of every run is appended to rsync-summary.log.
+#
+# The full per-file output is optionally appended to a gzip compressed log
+# (<name>-files.log.gz, read with zcat). The itemized lines of the received
+# files and of the deletions can be written to a separate file for the
+# snapshot index.
+#
+# The maximum number of deletions is enforced by rsync itself using
+# --max-delete, rsync returns 25 when deletions have been skipped.
+#
+# Usage: rsyncstream.py -n NAME [-m MAX_DELETIONS] [-i ITEMIZE [-a]] [-f] -- [sudo] rsync ARGS...
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import fcntl
+import signal
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.config import Config
+
+
+# rsync output format: itemized changes, file size and name
+OUT_FORMAT = "%i %l %n%L"
+
+# Itemized output line as (changes, size, name), size is missing for deletions
+ITEMIZE_LINE = re.compile(r"^(\*deleting|[<>ch.][fdLDS][^ ]*) +(?:(\d+) )?(.*)$")
+
+# Interval in seconds between progress lines
+PROGRESS_INTERVAL = 60
+
+# Name of the run summary log within LOG_DIR
+SUMMARY_LOG = "rsync-summary.log"
+
+# rsync exit code when deletions have been skipped due to --max-delete
+RV_MAX_DELETE = 25
+
+MB = 1024 ** 2
+
+
+class Stats:
+    """
+    Counters of an rsync run.
+    """
+    def __init__(self, expected=0):
+        self.start = time.time()
+        self.items = 0          # Itemized lines
+        self.files = 0          # Transferred files
+        self.bytes = 0          # Size of the transferred files
+        self.created = 0        # Created directories, links and devices
+        self.deleted = 0        # Deleted files and directories
+        self.expected = expected
+
+    # Count an itemized line
+    def add(self, changes, size):
+        self.items += 1
+        if changes == "*deleting":
+            self.deleted += 1
+        elif changes[0] in "<>" and changes[1] == "f":
+            self.files += 1
+            self.bytes += size
+        elif changes[0] == "c":
+            self.created += 1
+
+    # Compact progress line
+    def progress(self):
+        elapsed = max(time.time() - self.start, 0.001)
+        text = (f"progress: {self.files} files, {self.bytes / MB:.1f} MB transferred, {self.deleted} deleted, "
+                f"{self.bytes / MB / elapsed:.2f} MB/s")
+        if self.expected > self.items:
+            eta = (self.expected - self.items) * elapsed / max(self.items, 1)
+            text += f", ETA {int(eta // 60)}:{int(eta % 60):02d}"
+        return text
+
+    # Run summary
+    def summary(self, name, rv):
+        return {
+            "name": name,
+            "start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start)),
+            "duration": round(time.time() - self.start, 1),
+            "items": self.items,
+            "files": self.files,
+            "bytes": self.bytes,
+            "created": self.created,
+            "deleted": self.deleted,
+            "rv": rv,
+        }
+
+
+# rsync command with the output format and deletion limit options
+def rsync_command(command, max_deletions=None):
+    command = list(command)
+    for i, arg in enumerate(command):
+        if os.path.basename(arg) == "rsync":
+            options = [f"--out-format={OUT_FORMAT}"]
+            if max_deletions is not None:
+                options.append(f"--max-delete={max_deletions}")
+            command[i + 1:i + 1] = options
+            return command
+    raise ValueError("rsync command expected")
+
+
+# Item count of the previous run of the given name from the summary log, or 0
+def previous_items(path, name):
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 65536))
+            lines = f.read().decode(errors="replace").splitlines()
+    except OSError:
+        return 0
+    for line in reversed(lines):
+        try:
+            summary = json.loads(line)
+        except ValueError:
+            continue
+        if summary.get("name") == name and summary.get("rv") in (0, 24):
+            return summary.get("items", 0)
+    return 0
+
+
+# Append a line to a log file
+def append(path, line):
+    try:
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Failed to write {path}: {e}", file=sys.stderr)
+
+
+# Run rsync and process its output, returns the rsync exit code
+def run(name, command, max_deletions=None, itemize=None, file_log=None, summary_log=None, append_itemize=False):
+    stats = Stats(previous_items(summary_log, name) if summary_log else 0)
+    # File names that are not valid UTF-8 are written back as the original bytes
+    itemize_file = open(itemize, "a" if append_itemize else "w", errors="surrogateescape") if itemize else None
+    file_log = gzip.open(file_log, "at", errors="surrogateescape") if file_log else None
+    if file_log:
+        file_log.write(f"### {name} {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+    proc = subprocess.Popen(rsync_command(command, max_deletions), stdout=subprocess.PIPE,
+                            text=True, errors="surrogateescape", bufsize=1)
+    # Stop rsync, not this script, on SIGTERM so that the summary is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: proc.terminate())
+    last = time.monotonic()
+    try:
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+            match = ITEMIZE_LINE.match(line)
+            if match is None:
+                # rsync messages, e.g. "sending incremental file list" and the transfer totals
+                if line:
+                    print(line, flush=True)
+                continue
+            changes, size, path = match.groups()
+            stats.add(changes, int(size or 0))
+            if file_log:
+                file_log.write(line + "\n")
+            if itemize_file and (changes == "*deleting" or changes[0] == ">" and changes[1] == "f"):
+                itemize_file.write(f"{changes} {path}\n")
+            if time.monotonic() - last >= PROGRESS_INTERVAL:
+                last = time.monotonic()
+                print(stats.progress(), flush=True)
+        rv = proc.wait()
+    finally:
+        if itemize_file:
+            itemize_file.close()
+        if file_log:
+            file_log.close()
+
+    print(stats.progress().replace("progress", "done"), flush=True)
+    if rv == RV_MAX_DELETE:
+        print(f"more than {max_deletions} deletions, remaining deletions skipped", flush=True)
+    if summary_log:
+        append(summary_log, json.dumps(stats.summary(name, rv)))
+    return rv
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="Run rsync and log compact progress and a summary instead of every file"
+    )
+    parser.add_argument("-n", "--name", required=True, help="Name of the run, used for the summary and ETA")
+    parser.add_argument("-m", "--max-deletions", type=int, help="Maximum number of deletions")
+    parser.add_argument("-i", "--itemize", help="Write the itemized lines of the received files and deletions to this file")
+    parser.add_argument("-a", "--append", action="store_true", help="Append to the itemize file instead of overwriting it")
+    parser.add_argument("-f", "--file-log", action="store_true", help="Append the full per-file output to LOG_DIR/NAME-files.log.gz")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="rsync command line, preceded by --")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    sys.stdout.reconfigure(errors="surrogateescape")
+    config = Config()
+    log_dir = config.get("LOG_DIR", "/var/log/nastia-server")
+    file_log = os.path.join(log_dir, f"{args.name}-files.log.gz") if args.file_log or config["BACKUP_FILE_LOG"] == "yes" else None
+
+    try:
+        rv = run(args.name, command, args.max_deletions, args.itemize, file_log, os.path.join(log_dir, SUMMARY_LOG),
+                 args.append)
+    except (OSError, ValueError) as e:
+        print(f"Failed to run rsync: {e}", file=sys.stderr)
+        rv = 1
+    sys.exit(rv)
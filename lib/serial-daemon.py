@@ -36,6 +36,10 @@ import re
 import errno
 import argparse
 import logging
+import json
+import socket
+import selectors
+from collections import deque
 
 import serial  # pip install pyserial
 
@@ -46,6 +50,8 @@ except:
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from lib.ulock import ULock, ULockException
+from lib.nlog import NLog
+from lib.serialio import SerialIO
 
 
 # Current directory where this script is located
@@ -56,86 +62,375 @@ dir = os.path.dirname(os.path.abspath(__file__))
 TRX_LOG     = True  # Enable transmit/receive logging
 POLL_RX     = True  # Poll srial port for received data
 RETRY_COUNT = 2     # Number of connection retries
+POLL_FILE   = 1.0   # Input file polling interval in seconds
+REQUEST_TIMEOUT = 30  # Default time in seconds to wait for a request response
+RESPONSE_WAIT   = 1.0 # Time in seconds to hold the lock while waiting for a response
+PIPELINE_DEPTH  = 8   # Maximum number of pipelined requests sent at once
+MAX_REQUEST     = 4096  # Maximum request line length in bytes
+MIN_IDLE        = 0.05  # Minimum idle gap in seconds that ends a response (Bluetooth delivers data in bursts)
 
 
 # Global state used by helpers
 dev = None
 log = None
 log_trx = None
+nlog = None
+nlog_trx = None
 terminate = False
 ser = None
+sio = None
+retry = 0
 
 
 # Print info log message
 def info_log(text: str) -> None:
-    global dir, log
+    global nlog
     global logger
     logger.info(text)
     print(text)
-    os.popen(f"{dir}/infoLog.sh \"{text}\" '{log}' '' 'cd'")
+    nlog.info(text)
 
 
 # Print warning log message
 def warning_log(text: str) -> None:
-    global dir, log
+    global nlog
     global logger
     logger.warning(text)
     print(f"[WARNING] {text}")
-    os.popen(f"{dir}/warningLog.sh \"{text}\" '{log}' '' 'cd'")
+    nlog.warning(text)
 
 
 # Print error log message
 def error_log(text: str) -> None:
-    global dir, log
+    global nlog
     global logger
     logger.error(text)
     print(f"[ERROR] {text}")
-    os.popen(f"{dir}/errorLog.sh \"{text}\" '{log}' '' 'cd'")
+    nlog.error(text)
 
 
 # Print transmit/receive log message
 def trx_log(text: str) -> None:
-    global log_trx
+    global nlog_trx
     if TRX_LOG:
         # Remove empty lines
         text = re.sub(r"\n\s*\n", "\n", text, flags=re.MULTILINE)
         print(text)
-        os.popen(f"{dir}/infoLog.sh \"\n{text}\" '{log_trx}' '' 'd'")
+        nlog_trx.info(f"\n{text}")
 
 
-# Read the contents of the receive buffer
-def read() -> str:
-    global dev, ser
-    if ser is None:
+# Read a complete response, waiting up to timeout seconds for its first byte
+def read(timeout: float = 0.0, count: int = 1) -> str:
+    global dev, sio
+    if sio is None:
         error_log(f"Attempted read but serial port is not open for {dev}")
         return ""
 
-    rx = " "
-    result = ""
-    while len(rx) > 0:
-        try:
-            line = ser.readline()
-            if not line:
-                break
-            rx = line.decode(errors="replace")
-            result += rx
-            time.sleep(0.1)
-        except Exception as e:
-            raise
-    return result
+    return sio.read(timeout, count).decode(errors="replace")
 
 
 # Write to the transmit buffer
 def write(data: str) -> None:
-    global dev, ser
-    if ser is None:
+    global dev, sio
+    if sio is None:
         error_log(f"Attempted write but serial port is not open for {dev}")
         raise RuntimeError("Serial port not open")
 
+    sio.write(data)
+
+
+# Return the leading part of the text up to and including the first line
+# matching the terminator, or None if no complete response was received
+def split_response(text: str, terminator) -> str:
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        pos += len(line)
+        if line.endswith("\n") and terminator.fullmatch(line.strip()):
+            return text[:pos]
+    return None
+
+
+# Read a pending command from the input file (fallback for old clients)
+def read_in_file(in_file: str) -> str:
+    tx = ""
     try:
-        ser.write(data.encode())
-    except Exception as e:
-        raise
+        with open(in_file, "r") as f:
+            tx = f.read()
+        os.remove(in_file)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        warning_log(f"Failed to read or remove input file {in_file}: {e}")
+    return tx
+
+
+# Write a response to the output file (fallback for old clients)
+def write_out_file(out_file: str, rx: str) -> None:
+    try:
+        with open(out_file, "w") as f:
+            f.write(rx)
+
+        os.chmod(out_file, 0o666)   # rw-rw-rw-
+
+    except OSError as e:
+        error_log(f"Failed to open file {out_file}: {e}")
+
+
+# Create the Unix domain socket that accepts requests
+def open_server(path: str) -> socket.socket:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o666)   # rw-rw-rw-
+    server.listen(8)
+    server.setblocking(False)
+    return server
+
+
+# Request queued for transmission over the serial port
+class Request:
+    def __init__(self, id, command, timeout, client=None, pipeline=False):
+        self.id = id
+        self.command = command if command.endswith("\n") else command + "\n"
+        self.deadline = time.monotonic() + timeout
+        self.client = client      # None for input file requests
+        self.pipeline = pipeline  # May be sent together with other pipelined requests
+
+    def expired(self, now):
+        return now >= self.deadline
+
+
+# Socket client connection with its own receive buffer and reply slot
+class Client:
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.settimeout(1.0)
+        self.buffer = b""
+        self.pending = 0      # Number of unanswered requests
+        self.raw = False      # Plain text request: reply with the raw response and close
+        self.eof = False      # Client has finished sending requests
+        self.closed = False
+
+    # Send a reply, returns False if the client has gone away
+    def send(self, data):
+        if self.closed:
+            return False
+        try:
+            self.conn.sendall(data)
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.conn.close()
+
+
+# Serves queued requests from many clients over a single serial link
+class Daemon:
+    def __init__(self, server, in_file, out_file, lock, terminator=None):
+        self.server = server
+        self.in_file = in_file
+        self.out_file = out_file
+        self.lock = lock
+        self.terminator = terminator    # Compiled end-of-response regex, enables pipelining
+        self.queue = deque()            # Requests waiting for transmission (FIFO)
+        self.inflight = deque()         # Requests sent and waiting for a response
+        self.rx_buffer = ""             # Received data not yet assigned to a request
+        self.next_id = 1
+        self.next_poll = 0
+
+        # Socket clients are kept across serial reconnects
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+
+    # Serve requests while the serial port is open
+    def run(self):
+        if POLL_RX:
+            self.selector.register(ser.fileno(), selectors.EVENT_READ, "serial")
+        try:
+            while not terminate:
+                rx = ""
+                events = self.selector.select(self.timeout())
+                for key, _ in events:
+                    if key.fileobj is self.server:
+                        self.accept()
+                    elif key.data == "serial":
+                        with self.lock:
+                            rx += read()
+                    else:
+                        self.receive(key.data)
+
+                # Try to read pending command from input file
+                if time.monotonic() >= self.next_poll:
+                    self.next_poll = time.monotonic() + POLL_FILE
+                    tx = read_in_file(self.in_file)
+                    if tx:
+                        self.enqueue(Request(self.new_id(), tx, REQUEST_TIMEOUT))
+
+                if rx:
+                    self.dispatch(rx, rx)
+                self.expire()
+                self.serve()
+        finally:
+            if POLL_RX:
+                self.selector.unregister(ser.fileno())
+            # Responses to in-flight requests are lost with the connection,
+            # queued requests are served after reconnecting
+            while self.inflight:
+                self.complete(self.inflight.popleft(), "error", "")
+            self.rx_buffer = ""
+
+    # Time until the next input file poll or request deadline
+    def timeout(self):
+        deadline = self.next_poll
+        for req in list(self.inflight)[:1] + list(self.queue)[:1]:
+            deadline = min(deadline, req.deadline)
+        return max(0, deadline - time.monotonic())
+
+    def new_id(self):
+        id = str(self.next_id)
+        self.next_id += 1
+        return id
+
+    # Accept a new socket client
+    def accept(self):
+        try:
+            conn, _ = self.server.accept()
+        except OSError:
+            return
+        client = Client(conn)
+        self.selector.register(conn, selectors.EVENT_READ, client)
+
+    # Receive request lines from a socket client
+    def receive(self, client):
+        try:
+            data = client.conn.recv(MAX_REQUEST)
+        except OSError:
+            data = b""
+        if not data:
+            client.eof = True
+            self.selector.unregister(client.conn)
+            self.release(client)
+            return
+
+        client.buffer += data
+        while b"\n" in client.buffer:
+            line, client.buffer = client.buffer.split(b"\n", 1)
+            self.parse(client, line.decode(errors="replace"))
+        if len(client.buffer) > MAX_REQUEST:
+            warning_log("Request too long, closing client connection")
+            client.eof = True
+            self.selector.unregister(client.conn)
+            client.close()
+
+    # Parse a request line, either a JSON object or a plain command
+    def parse(self, client, line):
+        if not line.strip():
+            return
+        if line.lstrip().startswith("{"):
+            try:
+                msg = json.loads(line)
+                id = str(msg.get("id") or self.new_id())
+                command = str(msg["command"])
+                timeout = float(msg.get("timeout", REQUEST_TIMEOUT))
+                pipeline = bool(msg.get("pipeline", False))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                client.send((json.dumps({"id": None, "status": "error", "response": f"Invalid request: {e}"}) + "\n").encode())
+                return
+        else:
+            client.raw = True
+            id, command, timeout, pipeline = self.new_id(), line, REQUEST_TIMEOUT, False
+        client.pending += 1
+        self.enqueue(Request(id, command, timeout, client, pipeline))
+
+    def enqueue(self, req):
+        self.queue.append(req)
+
+    # Close a client once all of its requests have been answered
+    def release(self, client):
+        if client.pending == 0 and (client.eof or client.raw):
+            if not client.eof:
+                self.selector.unregister(client.conn)
+                client.eof = True
+            client.close()
+
+    # Deliver a response to the request's reply slot
+    def complete(self, req, status, response):
+        client = req.client
+        if client is None:
+            if response:
+                write_out_file(self.out_file, response)
+            return
+        if client.closed:
+            pass  # Client connection already closed, drop the response
+        elif client.raw:
+            client.send(response.encode())
+        else:
+            reply = {"id": req.id, "status": status, "response": response}
+            client.send((json.dumps(reply) + "\n").encode())
+        client.pending -= 1
+        self.release(client)
+
+    # Drop requests whose clients have stopped waiting
+    def expire(self):
+        now = time.monotonic()
+        for req in [r for r in self.queue if r.expired(now) or (r.client and r.client.closed)]:
+            self.queue.remove(req)
+            self.complete(req, "timeout", "")
+        while self.inflight and self.inflight[0].expired(now):
+            self.complete(self.inflight.popleft(), "timeout", "")
+            # Any partial response belongs to the expired request
+            self.rx_buffer = ""
+
+    # Transmit the next request, or a batch of pipelined requests
+    def serve(self):
+        if self.inflight or not self.queue:
+            return
+        batch = [self.queue.popleft()]
+        if self.terminator is not None and batch[0].pipeline:
+            while self.queue and self.queue[0].pipeline and len(batch) < PIPELINE_DEPTH:
+                batch.append(self.queue.popleft())
+
+        tx = "".join(req.command for req in batch)
+        rx = ""
+        with self.lock:
+            write(tx)
+            self.inflight.extend(batch)
+            # Hold the lock until the responses arrive or the wait expires
+            rx = read(RESPONSE_WAIT, len(batch))
+        self.dispatch(rx, tx + rx)
+
+    # Assign received data to the in-flight requests in FIFO order
+    def dispatch(self, rx, trx):
+        global retry
+        if trx:
+            trx_log(trx)
+            retry = RETRY_COUNT  # Reset retry counter on successul transmit/receive
+        if not rx:
+            return
+
+        if self.terminator is None:
+            if self.inflight:
+                self.complete(self.inflight.popleft(), "ok", rx)
+            else:
+                write_out_file(self.out_file, rx)
+            return
+
+        self.rx_buffer += rx
+        while self.inflight:
+            response = split_response(self.rx_buffer, self.terminator)
+            if response is None:
+                break
+            self.rx_buffer = self.rx_buffer[len(response):]
+            self.complete(self.inflight.popleft(), "ok", response)
+        if not self.inflight and self.rx_buffer:
+            write_out_file(self.out_file, self.rx_buffer)
+            self.rx_buffer = ""
 
 
 # Handle Ctrl+C
@@ -196,6 +491,11 @@ if __name__ == "__main__":
         help="Baud rate (default: 9600)",
     )
 
+    parser.add_argument(
+        "-t", "--terminator",
+        help="Regular expression matching the last line of each response, enables pipelining",
+    )
+
     args = parser.parse_args()
 
     dev_short = str(args.device).replace("/dev/", "")  # Serial device name without the /dev prefix
@@ -204,10 +504,15 @@ if __name__ == "__main__":
     log_trx = f"{log}-{dev_short}"  # Transmit/receive log
     baud_rate = args.baud_rate      # Serial baud rate
 
+    nlog = NLog(log, mode="cd")          # Main and common logs
+    nlog_trx = NLog(log_trx, mode="d")   # Transmit/receive log
+
     in_file = f"/tmp/serial-daemon-in-{dev_short}"
     out_file = f"/tmp/serial-daemon-out-{dev_short}"
+    sock_file = f"/tmp/serial-daemon-{dev_short}.sock"
     print("Input file: ", in_file)
     print("Output file:", out_file)
+    print("Socket:     ", sock_file)
 
     try:
         os.remove(out_file)
@@ -216,72 +521,47 @@ if __name__ == "__main__":
     except OSError as e:
         warning_log(f"Failed to remove old output file {out_file}: {e}")
 
+    try:
+        server = open_server(sock_file)
+    except OSError as e:
+        error_log(f"Failed to create socket {sock_file}: {e}")
+        sys.exit(1)
+
+    terminator = re.compile(args.terminator) if args.terminator else None
+
     # System-wide lock ensures mutually exclusive access to the serial port
-    lock = Lock(dev, timeout=45, stale_timeout=30)
+    lock = Lock(dev, timeout=45, stale_timeout=30, stats=True)
 
-    tx = ""
+    daemon = Daemon(server, in_file, out_file, lock, terminator)
     retry = RETRY_COUNT
 
     while retry > 0 and not terminate:
         try:
             # Open serial port
             with serial.Serial(dev, baud_rate, timeout=0.1) as ser:
+                sio = SerialIO(ser, args.terminator, min_idle=MIN_IDLE)
                 info_log(f"Connected to {dev} at {baud_rate} baud")
-
-                while not terminate:
-                    rx = ""
-                    trx = ""
-
-                    # Try to read pending command from input file
-                    try:
-                        with open(in_file, "r") as f:
-                            tx = f.read()
-                        os.remove(in_file)
-                    except FileNotFoundError:
-                        # No command yet; poll again
-                        time.sleep(1)
-                    except OSError as e:
-                        warning_log(f"Failed to read or remove input file {in_file}: {e}")
-                        time.sleep(0.3)
-
-                    with lock:
-                        if tx:
-                            write(tx)
-                            time.sleep(0.1)
-                        if tx or POLL_RX:
-                            rx = read()  # Poll serial
-                        trx = tx + rx
-
-                    if rx:
-                        try:
-                            with open(out_file, "w") as f:
-                                f.write(rx)
-
-                            os.chmod(out_file, 0o666)   # rw-rw-rw-
-
-                        except OSError as e:
-                            error_log(f"Failed to open file {out_file}: {e}")
-
-                    if trx:
-                        trx_log(trx)
-                        retry = RETRY_COUNT  # Reset retry counter on successul transmit/receive
-
-                    tx = ""
+                daemon.run()
 
         except serial.SerialException as e:
             if terminate:
-                sys.exit(0)
+                break
             else:
                 error_log(f"Serial error while connected to {dev}: {e}")
                 time.sleep(5)
                 retry -= 1
         except Exception as e:
             if terminate:
-                sys.exit(0)
+                break
             else:
                 error_log(f"Unexpected error with {dev}: {e}")
                 time.sleep(5)
                 retry -= 1
 
-    sys.exit(0 if terminate else 1)
+    server.close()
+    try:
+        os.remove(sock_file)
+    except OSError:
+        pass
 
+    sys.exit(0 if terminate else 1)
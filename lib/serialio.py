@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Framed reads from a serial port
+#
+# Reads a complete response in as few system calls as possible instead of
+# calling readline() and sleeping after every line. A response ends when
+# a line matching the end-of-response marker has been received, or when
+# the line stays idle for a number of character times at the current baud
+# rate.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import re
+import time
+import selectors
+
+
+# Default idle gap in character times that ends a response
+IDLE_CHARS = 20
+
+# Default lower bound for the idle gap in seconds
+MIN_IDLE = 0.02
+
+
+class SerialIO:
+    """
+    Framing layer on top of an open pyserial port.
+
+    terminator: regular expression (str or bytes) matching the last line of a
+                response, a response also ends after an idle gap
+    idle_chars: idle gap in character times at the port's baud rate
+    min_idle:   lower bound for the idle gap in seconds
+    """
+    def __init__(self, ser, terminator=None, idle_chars=IDLE_CHARS, min_idle=MIN_IDLE):
+        self.ser = ser
+        if isinstance(terminator, str):
+            terminator = terminator.encode()
+        self.terminator = re.compile(terminator) if terminator else None
+        self.idle_chars = idle_chars
+        self.min_idle = min_idle
+
+    # Duration of a single character in seconds (start + data + parity + stop bits)
+    @property
+    def char_time(self):
+        bits = 1 + self.ser.bytesize + (0 if self.ser.parity == "N" else 1) + self.ser.stopbits
+        return bits / (self.ser.baudrate or 9600)
+
+    # Idle gap in seconds that ends a response
+    @property
+    def idle_gap(self):
+        return max(self.min_idle, self.idle_chars * self.char_time)
+
+    # Write a string or bytes to the transmit buffer
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.ser.write(data)
+
+    # Read a complete response, waiting up to timeout seconds for its first byte.
+    # Stops after count terminator lines or after an idle gap.
+    def read(self, timeout=0.0, count=1):
+        buf = bytearray()
+        scan = 0      # Start of the first line not yet checked for the terminator
+        found = 0     # Number of terminator lines received
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.ser.fileno(), selectors.EVENT_READ)
+            while True:
+                if buf:
+                    wait = self.idle_gap
+                else:
+                    wait = max(0.0, deadline - time.monotonic())
+                if not self.ser.in_waiting and not selector.select(wait):
+                    break
+                buf += self.ser.read(self.ser.in_waiting or 1)
+
+                if self.terminator is not None:
+                    scan, matches = self._scan(buf, scan)
+                    found += matches
+                    if found >= count:
+                        break
+        return bytes(buf)
+
+    # Count terminator lines among the complete lines starting at scan
+    def _scan(self, buf, scan):
+        matches = 0
+        with memoryview(buf) as view:
+            end = buf.find(b"\n", scan)
+            while end >= 0:
+                # Match the line without surrounding white space
+                start, stop = scan, end
+                while start < stop and buf[start] in b" \t\r":
+                    start += 1
+                while stop > start and buf[stop - 1] in b" \t\r":
+                    stop -= 1
+                if self.terminator.fullmatch(view[start:stop]):
+                    matches += 1
+                scan = end + 1
+                end = buf.find(b"\n", scan)
+        return scan, matches
+
+    # Split a response into lines without copying
+    @staticmethod
+    def lines(data):
+        view = memoryview(data)
+        result = []
+        start = 0
+        end = data.find(b"\n")
+        while end >= 0:
+            result.append(view[start:end + 1])
+            start = end + 1
+            end = data.find(b"\n", start)
+        if start < len(data):
+            result.append(view[start:])
+        return result
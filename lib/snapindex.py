@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+#
+# Inode index of the incremental backup snapshots
+#
+# SQLite database recording, for each snapshot created by backup-hdd, the
+# files whose inode is new in that snapshot (i.e. the files transferred by
+# rsync instead of being hard-linked to the previous snapshot), with their
+# size on disk. The index is built from the rsync --itemize-changes output
+# of each backup run, only the new files are stat'ed.
+#
+# An inode introduced by snapshot S is linked into every following snapshot
+# until a later snapshot introduces a new version of the same path. Deleting
+# a snapshot frees the inodes whose lifespan contains no other remaining
+# snapshot. Files deleted from the backup source do not show up in the
+# output of the backup run, backup-hdd finds them with a dry run of rsync
+# --delete against the previous snapshot and appends its "*deleting" lines
+# to the itemized output.
+#
+# The index doubles as a catalog of the file versions: every version of a
+# path is recorded once, with the snapshot that introduced it, so the
+# history of a file and the snapshot holding a given version are found by
+# a single index lookup instead of listing every snapshot.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import bisect
+import sqlite3
+
+from lib.cleanup import backup_names
+
+
+# Itemized rsync output line of a received regular file
+ITEMIZE_FILE = re.compile(r"^>f\S+ (.+)$")
+
+# Itemized rsync output line of a deleted file or directory
+ITEMIZE_DELETED = re.compile(r"^\*deleting +(.+)$")
+
+# Escaped non-printable characters in rsync output file names
+_ESCAPE = re.compile(r"\\#([0-7]{3})")
+
+# Highest code point, upper bound for prefix range queries
+_MAX_CHAR = chr(0x10ffff)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    name    TEXT PRIMARY KEY,
+    files   INTEGER NOT NULL,
+    bytes   INTEGER NOT NULL,
+    chained INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    snapshot TEXT NOT NULL,
+    path     TEXT NOT NULL,
+    size     INTEGER NOT NULL,
+    next     TEXT,
+    mtime    INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_snapshot ON files (snapshot);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+
+# Paths of the received and of the deleted entries from itemized rsync output
+# lines, as a tuple of two lists. Deleted directories end with a slash.
+def parse_itemize(lines):
+    received, deleted = [], []
+    for line in lines:
+        line = line.rstrip("\n")
+        match = ITEMIZE_FILE.match(line)
+        if match:
+            received.append(_unescape(match.group(1)))
+            continue
+        match = ITEMIZE_DELETED.match(line)
+        if match:
+            deleted.append(_unescape(match.group(1)))
+    return received, deleted
+
+
+# Decode the escaped non-printable characters of an rsync output file name
+def _unescape(name):
+    return _ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), name)
+
+
+# Size on disk and modification time of a file, or None if it cannot be stat'ed
+def file_info(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return st.st_blocks * 512, int(st.st_mtime)
+
+
+# Snapshot names below root, sorted from oldest to newest
+def _names(root):
+    return backup_names(os.listdir(root))
+
+
+# Regular files below root as (relative path, inode, size on disk) tuples
+def _walk(root):
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    yield os.path.relpath(entry.path, root), st.st_ino, st.st_blocks * 512
+            except OSError:
+                continue
+
+
+class SnapshotIndex:
+    """
+    Inode index of the snapshots stored in the SQLite database at path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        # Add the columns missing in databases created by older versions
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(files)")]
+        if "mtime" not in columns:
+            self.db.execute("ALTER TABLE files ADD COLUMN mtime INTEGER")
+
+    def close(self):
+        self.db.close()
+
+    # Names of the indexed snapshots, sorted from oldest to newest
+    def snapshots(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM snapshots ORDER BY name")]
+
+    # True if all of the given snapshots have been indexed in sequence
+    def covers(self, names):
+        chained = set(row[0] for row in self.db.execute("SELECT name FROM snapshots WHERE chained = 1"))
+        return all(n in chained for n in names)
+
+    # Record the files of a new snapshot, paths are relative to the snapshot
+    # directory root/name. vanished are the paths of the previous snapshot
+    # missing in this one, if known. chained tells whether the previous
+    # snapshot was indexed.
+    def add(self, root, name, paths, vanished=(), chained=True):
+        entries = []
+        for path in set(paths):
+            info = file_info(os.path.join(root, name, path))
+            if info is not None:
+                entries.append((name, path) + info)
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE snapshot = ?", (name,))
+            self.db.executemany("UPDATE files SET next = ? WHERE path = ? AND next IS NULL AND snapshot < ?",
+                                ((name, path, name) for path in [e[1] for e in entries] + list(vanished)))
+            self.db.executemany("INSERT INTO files (snapshot, path, size, mtime) VALUES (?, ?, ?, ?)", entries)
+            self.db.execute("INSERT OR REPLACE INTO snapshots (name, files, bytes, chained) VALUES (?, ?, ?, ?)",
+                            (name, len(entries), sum(e[2] for e in entries), int(chained)))
+        return len(entries)
+
+    # Index a snapshot from the itemized rsync output of its backup run,
+    # including the deletions relative to the previous snapshot
+    def add_itemize(self, root, name, lines):
+        indexed = self.snapshots()
+        previous = [n for n in _names(root) if n < name]
+        chained = not previous or previous[-1] in indexed
+        paths, deleted = parse_itemize(lines)
+        return self.add(root, name, paths, self.vanished(name, deleted), chained=chained)
+
+    # Live paths before snapshot name matching the deleted entries, the files
+    # below a deleted directory included
+    def vanished(self, name, deleted):
+        result = []
+        for path in deleted:
+            if path.endswith("/"):
+                result += [row[0] for row in self.db.execute(
+                    "SELECT DISTINCT path FROM files WHERE path >= ? AND path < ? AND snapshot < ? AND next IS NULL",
+                    (path, path + _MAX_CHAR, name))]
+            else:
+                result.append(path)
+        return result
+
+    # Rebuild the index of the existing snapshots below root by comparing the
+    # inodes of consecutive snapshots, walks every snapshot once
+    def rebuild(self, root, progress=None):
+        with self.db:
+            self.db.execute("DELETE FROM files")
+            self.db.execute("DELETE FROM snapshots")
+        inodes = {}
+        for name in _names(root):
+            current = {}
+            new = []
+            for path, ino, size in _walk(os.path.join(root, name)):
+                current[path] = ino
+                if inodes.get(path) != ino:
+                    new.append(path)
+            self.add(root, name, new, [p for p in inodes if p not in current])
+            inodes = current
+            if progress:
+                progress(name, len(new))
+
+    # Bytes freed by deleting a snapshot while the existing ones are kept
+    def freed(self, name, existing):
+        existing = sorted(set(existing) | {name})
+        i = existing.index(name)
+        prev = existing[i - 1] if i > 0 else ""
+        if i + 1 < len(existing):
+            row = self.db.execute("SELECT SUM(size) FROM files WHERE snapshot > ? AND snapshot <= ? AND next > ? AND next <= ?",
+                                  (prev, name, name, existing[i + 1])).fetchone()
+        else:
+            row = self.db.execute("SELECT SUM(size) FROM files WHERE snapshot > ? AND snapshot <= ? AND (next IS NULL OR next > ?)",
+                                  (prev, name, name)).fetchone()
+        return row[0] or 0
+
+    # Callable returning the bytes freed by deleting a snapshot in addition to
+    # the ones passed before, for RetentionPlanner.plan() in lib/cleanup.py
+    def estimator(self, names):
+        existing = list(names)
+
+        def reclaim(name):
+            size = self.freed(name, existing)
+            existing.remove(name)
+            return size
+        return reclaim
+
+    # Drop the files whose lifespan contains none of the existing snapshots
+    def prune(self, existing):
+        existing = sorted(existing)
+        if not existing:
+            return
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE next <= ?", (existing[0],))
+            for a, b in zip(existing, existing[1:]):
+                self.db.execute("DELETE FROM files WHERE snapshot > ? AND next <= ?", (a, b))
+
+    # Versions of a path, or of all paths below a directory, as a list of
+    # (path, snapshot, size, mtime, next) sorted by path and snapshot
+    def history(self, path):
+        path = path.strip("/")
+        prefix = path + "/"
+        return self.db.execute("SELECT path, snapshot, size, mtime, next FROM files WHERE path = ? OR (path >= ? AND path < ?) "
+                               "ORDER BY path, snapshot", (path, prefix, prefix + _MAX_CHAR)).fetchall()
+
+    # Existing snapshots holding a version of a path as a list of names
+    @staticmethod
+    def holders(existing, start, next):
+        existing = sorted(existing)
+        i = bisect.bisect_left(existing, start)
+        j = len(existing) if next is None else bisect.bisect_left(existing, next)
+        return existing[i:j]
+
+    # Files of a path, or of all paths below a directory, as they were in the
+    # newest snapshot below root taken at or before the given snapshot name or
+    # time stamp prefix (default: the newest snapshot). Returns the snapshot and
+    # the list of paths found in it.
+    def locate(self, root, path, at=None):
+        existing = _names(root)
+        if at is not None:
+            existing = existing[:bisect.bisect_right(existing, at + _MAX_CHAR)]
+        if not existing:
+            return None, []
+        target = existing[-1]
+        result = []
+        for path, start, size, mtime, next in self.history(path):
+            if start <= target and (next is None or next > target):
+                if os.path.lexists(os.path.join(root, target, path)):
+                    result.append(path)
+        return target, result
+
+    # Bytes added per day as a list of (YYYY-MM-DD, bytes), since the given day
+    def growth(self, since=""):
+        return self.db.execute("SELECT substr(name, 1, 10) AS day, SUM(bytes) FROM snapshots WHERE name >= ? GROUP BY day ORDER BY day",
+                               (since,)).fetchall()
+
+    # Largest new files as a list of (snapshot, path, size), of one snapshot or of all
+    def largest(self, name=None, limit=20):
+        if name is None:
+            return self.db.execute("SELECT snapshot, path, size FROM files ORDER BY size DESC LIMIT ?", (limit,)).fetchall()
+        return self.db.execute("SELECT snapshot, path, size FROM files WHERE snapshot = ? ORDER BY size DESC LIMIT ?",
+                               (name, limit)).fetchall()
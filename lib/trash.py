@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#
+# Background deletion of hard-linked backup snapshots
+#
+# A snapshot is deleted by renaming it into the .trash directory of the
+# backup folder, which is atomic and immediately removes it from the backup
+# set. The trash is then emptied by a separate background process running
+# at idle CPU and I/O priority, so that the deletion does not hold the
+# backup-hdd lock.
+#
+# The trash directories are deleted by a pool of threads: each directory
+# is read once with os.scandir, its files are unlinked and its
+# subdirectories are queued; a directory is removed as soon as all of its
+# subdirectories have been removed. The deletion progress is reported to
+# the backup log.
+#
+# Usage: trash.py [-w WORKERS] [-l LOG] DIRECTORY
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import time
+import fcntl
+import shutil
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.nlog import NLog
+
+
+# Name of the trash directory within the backup folder
+TRASH_DIR = ".trash"
+
+# Lock file within the trash directory held by the deleting process
+LOCK_FILE = ".lock"
+
+# Default number of deleting threads, a few are enough to keep a disk queue busy
+WORKERS = 4
+
+# Interval in seconds between progress reports
+REPORT_INTERVAL = 60
+
+GB = 1024 ** 3
+
+
+# Trash directory of a backup folder
+def trash_dir(root):
+    return os.path.join(root, TRASH_DIR)
+
+
+# Move an entry of root into the trash, returns its path within the trash
+def move(root, name):
+    trash = trash_dir(root)
+    os.makedirs(trash, exist_ok=True)
+    dst = os.path.join(trash, name)
+    i = 1
+    while os.path.lexists(dst):
+        dst = os.path.join(trash, f"{name}.{i}")
+        i += 1
+    os.rename(os.path.join(root, name), dst)
+    return dst
+
+
+# Entries of the trash of root that have not been deleted yet
+def pending(root):
+    try:
+        return sorted(n for n in os.listdir(trash_dir(root)) if n != LOCK_FILE)
+    except FileNotFoundError:
+        return []
+
+
+# True if a process is emptying the trash of root, i.e. holds the trash lock
+def busy(root):
+    try:
+        fd = os.open(os.path.join(trash_dir(root), LOCK_FILE), os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+
+
+# Empty the trash of root in a detached background process at idle priority
+def spawn(root, log=None):
+    command = [sys.executable, os.path.abspath(__file__), root]
+    if log:
+        command[2:2] = ["--log", log]
+    if shutil.which("ionice"):
+        command = ["ionice", "-c", "3"] + command
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True, preexec_fn=lambda: os.nice(19))
+
+
+class Deleter:
+    """
+    Deletes directory trees on a bounded thread pool.
+
+    workers: number of deleting threads
+    report:  called with a progress message every REPORT_INTERVAL seconds
+    """
+    def __init__(self, workers=WORKERS, report=None):
+        self.workers = workers
+        self.report = report
+        self.files = 0         # Files unlinked
+        self.dirs = 0          # Directories removed
+        self.queued = 0        # Directories queued but not read yet
+        self.errors = 0
+        self._children = {}    # Directory: (parent, subdirectories not removed yet)
+        self._mutex = threading.Lock()
+        self._done = threading.Condition(self._mutex)
+        self._active = 0       # Directories queued or not removed yet
+        self._pool = None
+
+    # Delete the given directory trees, returns the number of errors
+    def delete(self, paths):
+        with ThreadPoolExecutor(max_workers=self.workers) as self._pool:
+            with self._mutex:
+                for path in paths:
+                    self._queue(path, None)
+            t1 = time.monotonic()
+            with self._done:
+                while self._active > 0:
+                    self._done.wait(timeout=max(0.1, REPORT_INTERVAL - (time.monotonic() - t1)))
+                    if self.report and time.monotonic() - t1 >= REPORT_INTERVAL:
+                        t1 = time.monotonic()
+                        self.report(self.progress())
+        return self.errors
+
+    # Progress message
+    def progress(self):
+        return f"{self.files} files and {self.dirs} directories removed, {self.queued} directories queued"
+
+    # Queue a directory for reading, called with the mutex held
+    def _queue(self, path, parent):
+        self._active += 1
+        self.queued += 1
+        self._children[path] = [parent, 1]   # Holds itself until its entries have been read
+        self._pool.submit(self._read, path)
+
+    # Unlink the files of a directory and queue its subdirectories
+    def _read(self, path):
+        subdirs = []
+        files = 0
+        failed = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                            files += 1
+                    except OSError as e:
+                        failed.append((entry.path, e))
+        except OSError as e:
+            failed.append((path, e))
+        with self._mutex:
+            for p, e in failed:
+                self._error(p, e)
+            self.files += files
+            self.queued -= 1
+            self._children[path][1] += len(subdirs)
+            for subdir in subdirs:
+                self._queue(subdir, path)
+            self._release(path)
+
+    # Drop a reference to a directory, removes it when all of its subdirectories
+    # have been removed. Called with the mutex held.
+    def _release(self, path):
+        while path is not None:
+            node = self._children[path]
+            node[1] -= 1
+            if node[1] > 0:
+                return
+            del self._children[path]
+            try:
+                os.rmdir(path)
+                self.dirs += 1
+            except OSError as e:
+                self._error(path, e)
+            self._active -= 1
+            self._done.notify_all()
+            path = node[0]
+
+    # Count and print an error, called with the mutex held
+    def _error(self, path, e):
+        self.errors += 1
+        if self.errors <= 10:
+            print(f"Failed to delete {path}: {e}", file=sys.stderr)
+
+
+#################
+####  START  ####
+#################
+if __name__ == '__main__':
+
+    # Argument parser
+    parser = argparse.ArgumentParser(
+        description="Delete the backup snapshots moved to the trash of DIRECTORY"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=WORKERS, help=f"Number of deleting threads (default: {WORKERS})")
+    parser.add_argument("-l", "--log", help="Log file for the progress reports (default: stdout)")
+    parser.add_argument("directory")
+    args = parser.parse_args()
+
+    nlog = NLog("trash", log=args.log, mode="dp" if args.log else "e")
+    trash = trash_dir(args.directory)
+    if not os.path.isdir(trash):
+        sys.exit(0)
+
+    # Only one process empties a trash, the running one picks up the new entries
+    lock = open(os.path.join(trash, LOCK_FILE), "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        sys.exit(0)
+
+    free1 = os.statvfs(trash)
+    while True:
+        names = pending(args.directory)
+        if not names:
+            break
+        t1 = time.monotonic()
+        deleter = Deleter(args.workers, report=lambda text: nlog.info(f"deleting {', '.join(names)}: {text}"))
+        nlog.info(f"deleting {', '.join(names)} ...")
+        errors = deleter.delete([os.path.join(trash, n) for n in names])
+        elapsed = time.monotonic() - t1
+        nlog.info(f"deleted {', '.join(names)}: {deleter.files} files and {deleter.dirs} directories in {elapsed:.0f} s "
+                  f"({deleter.files / max(elapsed, 0.001):.0f} files/s)")
+        if errors:
+            nlog.warning(f"failed to delete {errors} entries in {trash}")
+            break
+
+    free2 = os.statvfs(trash)
+    freed = (free2.f_bavail - free1.f_bavail) * free2.f_frsize
+    nlog.info(f"{freed / GB:.1f} GB freed, available disk space: {free2.f_bavail * free2.f_frsize / GB:.1f} GB")
+    nlog.close()
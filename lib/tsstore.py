@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+#
+# Binary time-series store
+#
+# Stores fixed-width records made of a timestamp and a number of float
+# columns in daily segment files. Segments are read through memory maps and
+# aggregated with memoryview slices, so that downsampling a month of
+# samples does not require parsing any text.
+#
+# Record layout: uint32 UNIX timestamp followed by one float32 per column,
+# little endian. Records are appended in chronological order.
+#
+# Completed segments are summarized in per-hour rollup files, so that
+# queries spanning months only read a few records per day.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import mmap
+import time
+import calendar
+import fcntl
+import struct
+from bisect import bisect_left
+
+
+# Segment file name: UTC date of its records
+SEGMENT_FORMAT = "%Y-%m-%d"
+SEGMENT_SUFFIX = ".dat"
+_SEGMENT = re.compile(r"^(\d{4}-\d{2}-\d{2})\.dat$")
+
+# Seconds per segment
+DAY = 86400
+
+# Rollup file suffix and interval in seconds. Past segments get a rollup
+# file with per-hour aggregates, used by queries aligned to full hours.
+ROLLUP_SUFFIX = ".sum"
+ROLLUP = 3600
+
+
+class Window:
+    """
+    Aggregate of the samples within [start, start + step).
+    min, max and mean are lists with one value per column.
+    """
+    def __init__(self, start, count, min, max, mean):
+        self.start = start
+        self.count = count
+        self.min = min
+        self.max = max
+        self.mean = mean
+
+
+class TimeSeriesStore:
+    """
+    Time series of fixed-width records stored in daily segment files.
+
+    directory: segment file directory, created on the first write
+    columns:   column names, one float32 value per column
+    retention: number of days to keep, older segments are deleted
+               by retain(), None keeps everything
+    """
+    def __init__(self, directory, columns, retention=None):
+        self.directory = directory
+        self.columns = list(columns)
+        self.retention = retention
+        self.record = struct.Struct("<I%df" % len(self.columns))
+        n = len(self.columns)
+        self.rollup = struct.Struct(f"<II{n}f{n}f{n}d")   # start, count, min, max, mean
+        self.width = len(self.columns) + 1   # Record size in 4-byte words
+        self._last_day = None
+
+    # Segment file path of the given UNIX time
+    def segment(self, timestamp):
+        name = time.strftime(SEGMENT_FORMAT, time.gmtime(timestamp))
+        return os.path.join(self.directory, name + SEGMENT_SUFFIX)
+
+    # Start time of all segment files, sorted
+    def segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        result = []
+        for name in names:
+            match = _SEGMENT.match(name)
+            if match:
+                day = calendar.timegm(time.strptime(match.group(1), SEGMENT_FORMAT))
+                result.append((day, os.path.join(self.directory, name)))
+        return sorted(result)
+
+    # Append a single sample
+    def append(self, timestamp, values):
+        self.extend([(timestamp, values)])
+
+    # Append a chronologically ordered list of (timestamp, values) samples
+    def extend(self, samples):
+        groups = {}
+        for timestamp, values in samples:
+            groups.setdefault(self.segment(timestamp), []).append(self.record.pack(int(timestamp), *values))
+        os.makedirs(self.directory, exist_ok=True)
+        for path, records in groups.items():
+            with open(path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(b"".join(records))
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        # Apply the retention policy once per day
+        day = int(time.time()) // DAY
+        if self.retention is not None and day != self._last_day:
+            self._last_day = day
+            self.retain()
+
+    # Merge samples into the store, keeps the records sorted and drops
+    # samples with a timestamp that is already stored. Used for imports.
+    def merge(self, samples):
+        groups = {}
+        for timestamp, values in samples:
+            groups.setdefault(self.segment(timestamp), {})[int(timestamp)] = values
+        os.makedirs(self.directory, exist_ok=True)
+        added = 0
+        for path, new in groups.items():
+            records = {}
+            for record in self._load(path):
+                records[record[0]] = record[1:]
+            for timestamp, values in new.items():
+                if timestamp not in records:
+                    records[timestamp] = values
+                    added += 1
+            data = b"".join(self.record.pack(t, *records[t]) for t in sorted(records))
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._unlink(self._rollup_path(path))
+        return added
+
+    # Delete the segments older than the retention period, returns their number
+    def retain(self, days=None):
+        days = self.retention if days is None else days
+        if days is None:
+            return 0
+        limit = (int(time.time()) // DAY - days) * DAY
+        deleted = 0
+        for start, path in self.segments():
+            if start < limit:
+                if self._unlink(path):
+                    deleted += 1
+                self._unlink(self._rollup_path(path))
+        return deleted
+
+    # Delete a file, returns True on success
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Failed to delete {path}: {e}", file=sys.stderr)
+            return False
+
+    # All records of a segment as a list of tuples
+    def _load(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        size = len(data) - len(data) % self.record.size
+        return list(self.record.iter_unpack(data[:size]))
+
+    # Memory map a segment, returns None if it is empty
+    def _map(self, path):
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % self.record.size   # Ignore a partially written record
+                if size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    # Newest record as a (timestamp, values) tuple, or None if the store is empty
+    def latest(self):
+        for day, path in reversed(self.segments()):
+            m = self._map(path)
+            if m is not None:
+                with m:
+                    record = self.record.unpack_from(m, len(m) - self.record.size)
+                return record[0], list(record[1:])
+        return None
+
+    # Downsample the samples within [start, end) into windows of step seconds,
+    # returns a list of Window objects, windows without samples are omitted.
+    # Queries where start, end and step are multiples of an hour use the rollups.
+    def query(self, start, end, step):
+        start, end, step = int(start), int(end), max(1, int(step))
+        hourly = start % ROLLUP == 0 and end % ROLLUP == 0 and step % ROLLUP == 0
+        result = []
+        for day, path in self.segments():
+            if day + DAY <= start or day >= end:
+                continue
+            if hourly:
+                for w in self._rollup(day, path):
+                    if start <= w.start < end:
+                        w.start = start + (w.start - start) // step * step
+                        result.append(w)
+            else:
+                result += self._scan(path, start, end, step)
+
+        # Combine windows with the same start, e.g. spanning a segment boundary
+        merged = []
+        for w in result:
+            if merged and merged[-1].start == w.start:
+                p = merged[-1]
+                count = p.count + w.count
+                mean = [(a * p.count + b * w.count) / count for a, b in zip(p.mean, w.mean)]
+                merged[-1] = Window(p.start, count, list(map(min, p.min, w.min)), list(map(max, p.max, w.max)), mean)
+            else:
+                merged.append(w)
+        return merged
+
+    # Aggregate the samples of a segment within [start, end) into windows of step seconds
+    def _scan(self, path, start, end, step):
+        m = self._map(path)
+        if m is None:
+            return []
+        # Timestamps and values are accessed as 4-byte words without copying
+        with m, memoryview(m) as view, view.cast("I") as words, view.cast("f") as values, \
+                words[0::self.width] as timestamps:
+            return self._aggregate(timestamps, values, start, end, step)
+
+    # Rollup file path of a segment
+    def _rollup_path(self, path):
+        return path[:-len(SEGMENT_SUFFIX)] + ROLLUP_SUFFIX
+
+    # Per-hour windows of a segment, read from its rollup file if up to date.
+    # The rollup file is created once the segment is complete.
+    def _rollup(self, day, path):
+        n = len(self.columns)
+        rpath = self._rollup_path(path)
+        try:
+            if os.stat(rpath).st_mtime >= os.stat(path).st_mtime:
+                with open(rpath, "rb") as f:
+                    return [Window(r[0], r[1], list(r[2:2 + n]), list(r[2 + n:2 + 2 * n]), list(r[2 + 2 * n:]))
+                            for r in self.rollup.iter_unpack(f.read())]
+        except (OSError, struct.error):
+            pass
+
+        windows = self._scan(path, day, day + DAY, ROLLUP)
+        if day + DAY <= time.time():
+            data = b"".join(self.rollup.pack(w.start, w.count, *w.min, *w.max, *w.mean) for w in windows)
+            try:
+                tmp = rpath + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, rpath)
+            except OSError:
+                pass   # Read-only store, the rollup is computed again next time
+        return windows
+
+    # Aggregate the windows of a single segment
+    def _aggregate(self, timestamps, values, start, end, step):
+        result = []
+        width = self.width
+        columns = range(len(self.columns))
+        index = bisect_left(timestamps, start)
+        last = bisect_left(timestamps, end, index)
+        while index < last:
+            window = start + (timestamps[index] - start) // step * step
+            stop = bisect_left(timestamps, window + step, index, last)
+            count = stop - index
+            mins, maxs, means = [], [], []
+            for c in columns:
+                column = values[index * width + 1 + c:stop * width:width]
+                mins.append(min(column))
+                maxs.append(max(column))
+                means.append(sum(column) / count)
+            result.append(Window(window, count, mins, maxs, means))
+            index = stop
+        return result
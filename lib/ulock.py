@@ -26,28 +26,65 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import os
+import fcntl
+import signal
+import threading
 from hashlib import sha256
 from tempfile import gettempdir
 from time import time, sleep
 
 
+# Lock backends
+#   file:  atomic creation of the lock file, waiters poll every check_interval
+#          seconds and locks older than stale_timeout seconds are broken
+#   flock: kernel file lock, waiters are woken as soon as the lock is released
+#          and the lock is released automatically when its holder terminates
+#
+# All processes sharing a lock name must use the same backend.
+BACKENDS = ("file", "flock")
+
+# Statistics file name within the lock directory, see bin/ulock-stats
+STATS_FILE = "ulock-stats.log"
+
+# The statistics file is rotated when exceeding this size in bytes
+STATS_MAX_SIZE = 1024 * 1024
+
+# Statistics events
+EVENT_ACQUIRE = "acquire"  # Lock acquired and released, with wait and hold time
+EVENT_TIMEOUT = "timeout"  # Timeout while waiting for the lock
+EVENT_STALE   = "stale"    # Stale lock broken
+
+
 class ULockException(Exception):
     pass
 
 
+class _AlarmTimeout(Exception):
+    pass
+
+
 class ULock:
     # Timeouts are in seconds
-    def __init__(self, name, timeout=None, check_interval=0.25, reentrant=False, lock_directory=None, stale_timeout=None):
+    # If stats is True, wait and hold times are appended to the statistics file
+    def __init__(self, name, timeout=None, check_interval=0.25, reentrant=False, lock_directory=None, stale_timeout=None, backend="file", stats=False):
+        if backend not in BACKENDS:
+            raise ULockException(f"Unknown lock backend: {backend}")
         self._timeout = timeout if timeout is not None else 10**8
         self._stale_timeout = stale_timeout if stale_timeout is not None else 600
         self._check_interval = check_interval
         self._reentrant = reentrant
+        self._backend = backend
         self._enter_count = 0
         self._fd = None
+        self._name = name
+        self._acquire_time = None
+        self._wait_time = None
 
         lock_directory = gettempdir() if lock_directory is None else lock_directory
+        self._statspath = os.path.join(lock_directory, STATS_FILE) if stats else None
         unique_token = sha256(name.encode()).hexdigest()
-        self._lockpath = os.path.join(lock_directory, f'ulock-{unique_token}.lock')
+        extension = "flock" if backend == "flock" else "lock"
+        self._lockpath = os.path.join(lock_directory, f'ulock-{unique_token}.{extension}')
 
     def acquire(self):
         if self._enter_count > 0:
@@ -56,13 +93,27 @@ class ULock:
                 return self
             raise ULockException('Trying to re-enter a non-reentrant lock')
 
+        start_time = time()
+        try:
+            if self._backend == "flock":
+                self._acquire_flock()
+            else:
+                self._acquire_file()
+        except ULockException:
+            self._record(EVENT_TIMEOUT, time() - start_time)
+            raise
+        self._enter_count = 1
+        self._acquire_time = time()
+        self._wait_time = self._acquire_time - start_time
+        return self
+
+    def _acquire_file(self):
         start_time = time()
         while time() - start_time < self._timeout:
             try:
                 self._fd = os.open(self._lockpath, os.O_CREAT | os.O_EXCL | os.O_RDWR)
                 os.write(self._fd, f"{os.getpid()}\n".encode())
-                self._enter_count = 1
-                return self
+                return
             except FileExistsError:
                 if self._stale_timeout is not None:
                     try:
@@ -70,6 +121,7 @@ class ULock:
                         age = time() - stat.st_mtime
                         if age > self._stale_timeout:
                             os.unlink(self._lockpath)
+                            self._record(EVENT_STALE)
                             continue  # Retry lock acquisition
                     except Exception:
                         pass   # Ignore and continue waiting
@@ -81,11 +133,101 @@ class ULock:
 
         raise ULockException('Timeout was reached while acquiring the lock')
 
+    def _acquire_flock(self):
+        fd = self._open_flock()
+
+        try:
+            if not self._flock(fd):
+                raise ULockException('Timeout was reached while acquiring the lock')
+        except BaseException:
+            os.close(fd)
+            raise
+
+        # The lock file is never deleted, its contents are for information only
+        try:
+            os.ftruncate(fd, 0)
+            os.write(fd, f"{os.getpid()}\n".encode())
+        except OSError:
+            pass
+        self._fd = fd
+
+    # Open the lock file, creating it if needed. An existing file is opened
+    # without O_CREAT: with fs.protected_regular, opening another user's file
+    # in a sticky directory such as /tmp with O_CREAT fails with EACCES.
+    def _open_flock(self):
+        for attempt in range(2):
+            try:
+                return os.open(self._lockpath, os.O_RDWR)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise ULockException(f"Unable to open the lock file: {e}")
+            try:
+                fd = os.open(self._lockpath, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o666)
+            except FileExistsError:
+                continue  # Created by another process in the meantime
+            except OSError as e:
+                raise ULockException(f"Unable to open the lock file: {e}")
+            try:
+                os.fchmod(fd, 0o666)  # Lock file is shared between users
+            except OSError:
+                pass
+            return fd
+        raise ULockException("Unable to open the lock file")
+
+    # Wait for the kernel lock, returns False on timeout
+    def _flock(self, fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if self._timeout <= 0:
+                return False
+
+        # Blocking wait interrupted by a timer signal, only possible in the main
+        # thread and if the caller does not use the interval timer itself
+        if threading.current_thread() is threading.main_thread() \
+                and signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0):
+            def alarm(signum, frame):
+                raise _AlarmTimeout()
+            handler = signal.signal(signal.SIGALRM, alarm)
+            signal.setitimer(signal.ITIMER_REAL, self._timeout)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                return True
+            except _AlarmTimeout:
+                return False
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, handler)
+
+        # Other threads poll like the file backend
+        start_time = time()
+        while time() - start_time < self._timeout:
+            sleep(min(self._check_interval, self._timeout))
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                pass
+        return False
+
     def release(self):
         self._enter_count -= 1
         if self._enter_count > 0:
             return
 
+        if self._acquire_time is not None:
+            self._record(EVENT_ACQUIRE, self._wait_time, time() - self._acquire_time)
+            self._acquire_time = None
+
+        if self._backend == "flock":
+            # Closing the file releases the lock
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            return
+
         try:
             if self._fd is not None:
                 os.close(self._fd)
@@ -96,6 +238,34 @@ class ULock:
         except OSError as e:
             raise ULockException(f"Unexpected error while releasing lock: {e}")
 
+    # Append an event to the statistics file, never fails
+    def _record(self, event, wait=0.0, hold=0.0):
+        if self._statspath is None:
+            return
+        line = f"{time():.3f} {event} {wait:.6f} {hold:.6f} {self._name}\n"
+        try:
+            fd = os.open(self._statspath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                os.write(fd, line.encode())
+                stat = os.fstat(fd)
+                if stat.st_uid == os.geteuid() and stat.st_mode & 0o777 != 0o666:
+                    os.fchmod(fd, 0o666)  # Statistics file is shared between users
+                size = stat.st_size
+            finally:
+                os.close(fd)
+            if size > STATS_MAX_SIZE:
+                os.replace(self._statspath, self._statspath + ".1")
+        except OSError:
+            pass
+
+    # Reset the lock file age of a held lock, prevents long running holders
+    # from being considered stale
+    def refresh(self):
+        if self._fd is not None:
+            try:
+                os.utime(self._lockpath)
+            except OSError:
+                pass
 
     def __enter__(self):
         return self.acquire()
@@ -34,8 +34,11 @@ import serial  # pip install pyserial
 import sys
 import os
 import time
+import signal
+import asyncio
 import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from systemd.journal import JournalHandler
 
 # Current directory where this script is located
@@ -43,47 +46,74 @@ dir = os.path.dirname(os.path.abspath(__file__))
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from lib.ulock import ULock, ULockException
+from lib.nlog import NLog
+from lib.config import Config
+from lib.serialio import SerialIO
+from lib import upsmeas
 
 # Polling interval in seconds
 INTERVAL = 5
 
+# Maximum time in seconds to wait for a response
+RESPONSE_TIMEOUT = 1
+
+# Minimum idle gap in seconds that ends a response, the UPS sends its lines
+# with short pauses in between
+MIN_IDLE = 0.1
+
+# Maximum time in seconds to wait for pending log messages before halting
+HALT_LOG_TIMEOUT = 5
+
+# Measurement log lines are collected for up to this many seconds
+MEAS_FLUSH_INTERVAL = 60
+
 # If the battery gets trickle charged more often than
 # the follwoing threshold (in hours), then a bad battery
 # warning will be written into the trace log.
 BAD_BATTERY_THRESHOLD = 48
 
 
+# Raised by the serial port thread when the UPS cannot be accessed
+class SerialPortError(Exception):
+    pass
+
+
 # Print info log message
 def infoLog(text):
-    global dir
+    global nlog
     global logger
     logger.info(text.rstrip())
     print(text.rstrip())
-    os.popen(dir + "/infoLog.sh \"" + text.rstrip() + "\" 'ups' '' 'cd'")
+    nlog.info(text.rstrip())
 
 
 # Print warning log message
 def warningLog(text):
-    global dir
+    global nlog
     global logger
     logger.warning(text.rstrip())
     print("[WARNING] " + text.rstrip())
-    os.popen(dir + "/warningLog.sh \"" + text.rstrip() + "\" 'ups' '' 'cd'")
+    nlog.warning(text.rstrip())
 
 
 # Print error log message
 def errorLog(text):
-    global dir
+    global nlog
     global logger
     logger.error(text.rstrip())
     print("[ERROR] " + text.rstrip())
-    os.popen(dir + "/errorLog.sh \"" + text.rstrip() + "\" 'ups' '' 'cd'")
+    nlog.error(text.rstrip())
 
 
 # Print a log message to the measurements log file
 def measLog(text):
-    global dir
-    os.popen(dir + "/infoLog.sh \"" + text.rstrip() + "\" 'ups-meas' '' 'd'")
+    global nlog_meas
+    nlog_meas.info(text.rstrip())
+
+# Append a (timestamp, values) measurement to the binary store
+def storeMeas(sample):
+    global store
+    store.append(*sample)
 
 # Print info log to systemd
 def systemLog(text):
@@ -93,45 +123,232 @@ def systemLog(text):
 
 
 # Read the contents of the receive buffer
-def read():
+def read(timeout=0):
     global device
-    global ser
-    rx = " "
-    result = ""
-    while len(rx) > 0:
-        try:
-            rx = ser.readline().decode()
-            result = result + rx
-        except:
-            print("Failed to read from", device)
-            sys.exit(1)
-    time.sleep(0.1)
-    return result
+    global sio
+    try:
+        return sio.read(timeout).decode()
+    except Exception as e:
+        raise SerialPortError(f"Failed to read from {device}") from e
 
 
 # Write to the transmit buffer
 def write(str):
     global device
-    global ser
+    global sio
     try:
-        ser.write(str.encode())
-    except:
-        print("Failed to write to", device)
-        sys.exit(1)
-    time.sleep(0.1)
+        sio.write(str)
+    except Exception as e:
+        raise SerialPortError(f"Failed to write to {device}") from e
+
+
+# Open the serial port
+def connect():
+    global ser
+    global sio
+    with lock:  # Ensure exclusive access through system-wide lock
+        ser = serial.Serial(device, baud_rate, timeout=0.1)
+        sio = SerialIO(ser, min_idle=MIN_IDLE)
+
 
+# Read the pending contents of the receive buffer
+def flush():
+    with lock:
+        return read()
+
+
+# Send a command and return the response
+def query(command):
+    with lock:
+        write(command)
+        return read(RESPONSE_TIMEOUT)
 
-# Extends ULock with exception handling
-class Lock(ULock):
-    def __enter__(self):
+
+# Write a batch of queued log messages
+def writeLog(batch):
+    for function, text in batch:
+        try:
+            function(text)
+        except Exception as e:
+            print(f"Failed to write log message: {e}", file=sys.stderr)
+
+
+class UpsService:
+    """
+    Asynchronous UPS service.
+
+    The sampler polls the UPS on a fixed-rate schedule and handles the low
+    battery shutdown. Log messages are queued and written by the writer task
+    in a separate thread, so that slow disks or a busy log semaphore cannot
+    delay the sampler. Serial port access runs in its own thread.
+    """
+    def __init__(self):
+        self.serialExecutor = ThreadPoolExecutor(max_workers=1)
+        self.logExecutor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.lastResult = ""
+        self.lastMeasResult = ""
+        self.measCount = 0
+        self.chargingFlag = False
+        self.wasOnBatteryFlag = True
+        self.lastChargeTime = datetime.datetime(1970, 1, 1)
+        self.logCount = 0
+
+    # Queue a log message for the writer task
+    def log(self, function, text):
+        self.queue.put_nowait((function, text))
+
+    # Run a blocking function in the serial port thread
+    async def serial(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.serialExecutor, function, *args)
+
+    # Write the queued log messages in batches
+    async def writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await loop.run_in_executor(self.logExecutor, writeLog, batch)
+            finally:
+                for item in batch:
+                    self.queue.task_done()
+
+    # Wait a bounded time until all log messages have been written
+    async def drain(self, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
         try:
-            return super().__enter__()
+            await asyncio.wait_for(self.queue.join(), timeout)
+            for log in (nlog, nlog_meas):
+                await asyncio.wait_for(loop.run_in_executor(self.logExecutor, log.flush, True),
+                                       max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            print("Timeout while writing the log messages", file=sys.stderr)
+
+    # Poll the UPS at a fixed rate
+    async def sampler(self):
+        loop = asyncio.get_running_loop()
+        nextTime = loop.time()
+        while True:
+            await self.sample()
+            # Skip cycles that have been missed
+            now = loop.time()
+            nextTime += INTERVAL
+            while nextTime <= now:
+                nextTime += INTERVAL
+            await asyncio.sleep(nextTime - now)
+
+    # Single polling cycle
+    async def sample(self):
+        # Read the UPS status
+        result = await self.serial(query, "stat\n")
+        self.logCount += 1
+        if self.logCount == 12:
+            self.logCount = 0
+            self.log(systemLog, result)
+
+        self.traceStatus(result)
+
+        # Handle low battery condition
+        if "BATTERY 0" in result:
+            await self.halt()
+
+        # Read the UPS measurements
+        result = await self.serial(query, "meas\n")
+        self.traceMeas(result)
+
+    # Trace the UPS status
+    def traceStatus(self, result):
+        if result == "" or result == self.lastResult:
+            return
+        self.lastResult = result
+        if "BATTERY" in result:
+            self.wasOnBatteryFlag = True
+            self.log(warningLog, result)
+        elif "ERROR" in result:
+            self.log(errorLog, result)
+        else:
+            # Bad battery detection
+            if "CHARGING" in result and not self.chargingFlag:
+                chargeTime = datetime.datetime.now()
+                delta = chargeTime - self.lastChargeTime
+                deltaHours = round(delta.days * 24 + delta.seconds / 3600)
+                self.lastChargeTime = chargeTime
+                self.log(infoLog, result.rstrip() + " (delta = " + str(deltaHours) + "h)")
+                if deltaHours < BAD_BATTERY_THRESHOLD and not self.wasOnBatteryFlag:
+                    self.log(warningLog, "bad battery (delta = " + str(deltaHours) + "h)")
+                self.chargingFlag = True
+                self.wasOnBatteryFlag = False
+            elif "CHARGING" in result:
+                self.log(infoLog, result)
+            else:
+                self.chargingFlag = False
+                self.log(infoLog, result)
+
+    # Trace the UPS measurements
+    def traceMeas(self, result):
+        values = upsmeas.parse(result)
+        if values is not None:
+            self.log(storeMeas, (time.time(), values))
+        if result == "" or result == self.lastMeasResult:
+            return
+        self.lastMeasResult = result
+        if self.measCount == 0:
+            self.log(measLog, "V_in   V_ups  V_batt I_batt PWM")
+        self.log(measLog, result)
+        self.measCount += 1
+        if self.measCount >= 20:
+            self.measCount = 0
+
+    # Shut down the system, waits at most HALT_LOG_TIMEOUT for the log messages
+    async def halt(self):
+        result = await self.serial(query, "halt\n")
+        if "SHUTDOWN" in result:
+            self.log(errorLog, result)
+            await self.drain(HALT_LOG_TIMEOUT)
+            os.popen("sudo halt")
+        else:
+            self.log(errorLog, "shutdown failed")
+
+    # Run the service until SIGTERM or a serial port failure, returns the exit code
+    async def run(self):
+        # Exit normally on SIGTERM so that the buffered log messages get written
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+        self.queue = asyncio.Queue()
+        writer = asyncio.create_task(self.writer())
+
+        self.log(infoLog, "UPS service started")
+
+        exitCode = 0
+        try:
+            # Initialize the serial port
+            await self.serial(connect)
+
+            # A serial connection will cause the MCU to reboot
+            # The following will flush the initial boot message
+            # and wait until the MCU is up and running
+            await asyncio.sleep(2)
+            result = await self.serial(flush)
+            sys.stdout.write(result)
+            await asyncio.sleep(2)
+
+            await self.sampler()
+        except asyncio.CancelledError:
+            pass  # Terminated by SIGTERM
+        except SerialPortError as e:
+            print(e)
+            exitCode = 1
         except ULockException as e:
             print(str(e), file=sys.stderr)
-            sys.exit(2)
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        return super().__exit__(exc_type, exc_val, exc_tb)
+            exitCode = 2
+        finally:
+            # Write the queued log messages before stopping the writer
+            await self.drain(HALT_LOG_TIMEOUT)
+            writer.cancel()
+        return exitCode
 
 
 #################
@@ -143,102 +360,24 @@ if __name__ == '__main__':
     logger.addHandler(JournalHandler())
     logger.setLevel(logging.INFO)
 
+    nlog = NLog("ups", mode="cd")
+    nlog_meas = NLog("ups-meas", mode="d", flush_interval=MEAS_FLUSH_INTERVAL)
+
+    # Device and baud rate default to UPS_DEVICE and UPS_BAUD_RATE
+    config = Config()
+    store = upsmeas.open_store(config)
+    device = sys.argv[1] if len(sys.argv) > 1 else config["UPS_DEVICE"]
+    baud_rate = sys.argv[2] if len(sys.argv) > 2 else config["UPS_BAUD_RATE"]
+
     # Check for correct number of arguments
-    if len(sys.argv) < 2:
-        print("usage: " + sys.argv[0] + " <device> <baud rate>")
+    if not device or not baud_rate:
+        print("usage: " + sys.argv[0] + " [<device> <baud rate>]")
         sys.exit()
 
-    device = sys.argv[1]  # RS232 device name
-    baud_rate = sys.argv[2]  # Serial baud rate
+    if not device.startswith("/dev/"):
+        device = "/dev/" + device  # RS232 device name
 
     # System-wide lock ensures mutually exclusive access to the serial port
-    lock = Lock(device, timeout=45, stale_timeout=30)
+    lock = ULock(device, timeout=45, stale_timeout=30, stats=True)
 
-    infoLog("UPS service started")
-
-    # Initialize the serial port
-    with lock:  # Ensure exclusive access through system-wide lock
-        ser = serial.Serial(device, baud_rate, timeout=0.1)
-
-    # A serial connection will cause the MCU to reboot
-    # The following will flush the initial boot message
-    # and wait until the MCU is up and running
-    time.sleep(2)
-    with lock:
-        result = read()
-    sys.stdout.write(result)
-    time.sleep(2)
-
-    lastResult = ""
-    lastMeasResult = ""
-    measCount = 0
-    chargingFlag = False
-    wasOnBatteryFlag = True
-    lastChargeTime = datetime.datetime(1970, 1, 1)
-    logCount = 0
-
-    # Main loop
-    while 1:
-
-        # Read the UPS status
-        with lock:
-            write("stat\n")
-            result = read()
-            logCount += 1
-            if logCount == 12:
-              logCount = 0
-              systemLog(result)
-
-        # Trace the UPS status
-        if result != "" and result != lastResult:
-            lastResult = result
-            if "BATTERY" in result:
-                wasOnBatteryFlag = True
-                warningLog(result)
-            elif "ERROR" in result:
-                errorLog(result)
-            else:
-                # Bad battery detection
-                if "CHARGING" in result and not chargingFlag:
-                    chargeTime = datetime.datetime.now()
-                    delta = chargeTime - lastChargeTime
-                    deltaHours = round(delta.days * 24 + delta.seconds / 3600)
-                    lastChargeTime = chargeTime
-                    infoLog(result.rstrip() + " (delta = " + str(deltaHours) + "h)")
-                    if deltaHours < BAD_BATTERY_THRESHOLD and not wasOnBatteryFlag:
-                        warningLog("bad battery (delta = " + str(deltaHours) + "h)")
-                    chargingFlag = True
-                    wasOnBatteryFlag = False
-                elif "CHARGING" in result:
-                    infoLog(result)
-                else:
-                    chargingFlag = False
-                    infoLog(result)
-
-        # Handle low battery condition
-        if "BATTERY 0" in result:
-            with lock:
-                write("halt\n")
-                result = read()
-            if "SHUTDOWN" in result:
-                errorLog(result)
-                os.popen("sudo halt")
-            else:
-                errorLog("shutdown failed")
-
-        # Read the UPS measurements
-        with lock:
-            write("meas\n")
-            result = read()
-
-        # Trace the UPS measurements
-        if result != "" and result != lastMeasResult:
-            lastMeasResult = result
-            if measCount == 0:
-                measLog("V_in   V_ups  V_batt I_batt PWM")
-            measLog(result)
-            measCount += 1
-            if measCount >= 20:
-                measCount = 0
-
-        time.sleep(INTERVAL)
+    sys.exit(asyncio.run(UpsService().run()))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# UPS measurement store
+#
+# Parses the response of the UPS "meas" command and stores it in the binary
+# time-series store configured by UPS_MEAS_DIR and UPS_MEAS_RETENTION.
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+
+from lib.config import Config
+from lib.tsstore import TimeSeriesStore
+
+
+# Columns of the meas response
+COLUMNS = ("V_in", "V_ups", "V_batt", "I_batt", "PWM")
+
+
+# Parse a meas response, returns the list of column values or None
+def parse(text):
+    fields = text.split()
+    if len(fields) < len(COLUMNS):
+        return None
+    try:
+        return [float(f) for f in fields[:len(COLUMNS)]]
+    except ValueError:
+        return None
+
+
+# Open the measurement store as configured
+def open_store(config=None):
+    config = config if config is not None else Config()
+    directory = config.get("UPS_MEAS_DIR") or os.path.join(config.get("LOG_DIR", "/var/log/nastia-server"), "ups-meas")
+    return TimeSeriesStore(directory, COLUMNS, config.getint("UPS_MEAS_RETENTION"))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Unit tests of the backup retention planner (lib/cleanup.py)
+#
+# Usage: python3 -m unittest discover tests
+#
+# This source file is part of the following repository:
+# http://www.github.com/microfarad-de/nastia-server
+#
+# Please visit:
+#   http://www.microfarad.de
+#   http://www.github.com/microfarad-de
+#
+# Copyright (C) 2026 Karim Hraibi (khraibi@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib.cleanup import RetentionPlanner, NAME_FORMAT, FREE_PERCENT, MAX_SPACE_DELETIONS, REASON_RULE, REASON_SPACE
+
+GB = 1024 ** 3
+
+# Date of the newest synthetic backup
+NEWEST = datetime(2026, 6, 30, 23, 0, 15)
+
+
+# Backup folder names taken every step, going back the given number of days from NEWEST
+def backups(days, step=timedelta(hours=1), newest=NEWEST):
+    result = []
+    t = newest
+    while t > newest - timedelta(days=days):
+        result.append(t.strftime(NAME_FORMAT))
+        t -= step
+    return result
+
+
+# Age in days of a backup relative to NEWEST
+def age(name):
+    return (NEWEST - RetentionPlanner.date(name)).days
+
+
+# Reclaim callable returning a fixed size and recording its calls
+class Reclaim:
+    def __init__(self, size):
+        self.size = size
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        return self.size
+
+
+class TestExpired(unittest.TestCase):
+
+    def setUp(self):
+        self.names = backups(120)
+        self.planner = RetentionPlanner(self.names)
+        self.expired = self.planner.expired()
+        self.kept = [n for n in self.planner.names if n not in self.expired]
+
+    def test_recent_backups_kept(self):
+        recent = [n for n in self.names if age(n) <= 2]
+        self.assertTrue(recent)
+        self.assertFalse(set(recent) & set(self.expired))
+
+    def test_spacing_of_kept_backups(self):
+        for previous, name in zip(self.kept, self.kept[1:]):
+            delta = (RetentionPlanner.date(name) - RetentionPlanner.date(previous)).days
+            if age(name) > 56:
+                self.assertGreaterEqual(delta, 28, name)
+            elif age(name) > 28:
+                self.assertGreaterEqual(delta, 7, name)
+            elif age(name) > 2:
+                self.assertGreaterEqual(delta, 1, name)
+
+    def test_thinning(self):
+        # One backup per day between 2 and 28 days, about one per week up to 56 days
+        daily = [n for n in self.kept if 2 < age(n) <= 28]
+        weekly = [n for n in self.kept if 28 < age(n) <= 56]
+        monthly = [n for n in self.kept if age(n) > 56]
+        self.assertIn(len(daily), (25, 26))
+        self.assertIn(len(weekly), (4, 5))
+        self.assertIn(len(monthly), (2, 3))
+
+    def test_oldest_and_newest_kept(self):
+        self.assertIn(self.planner.names[0], self.kept)
+        self.assertIn(self.planner.names[-1], self.kept)
+
+    def test_explicit_list(self):
+        names = [
+            "2026-01-01-120000",   # Oldest, kept
+            "2026-01-20-120000",   # 19 days after the previous kept one, older than 56 days: expired
+            "2026-02-05-120000",   # 35 days after 2026-01-01: kept
+            "2026-05-01-080000",   # Kept
+            "2026-05-01-090000",   # Same day, older than 28 days: expired
+            "2026-06-25-100000",   # Kept
+            "2026-06-25-110000",   # Same day, older than 2 days: expired
+            "2026-06-29-100000",   # Within 2 days: kept
+            "2026-06-29-110000",   # Within 2 days: kept
+            "2026-06-30-230015",   # Newest
+        ]
+        expected = ["2026-01-20-120000", "2026-05-01-090000", "2026-06-25-110000"]
+        self.assertEqual(RetentionPlanner(reversed(names)).expired(), expected)
+
+    def test_invalid_names_ignored(self):
+        planner = RetentionPlanner(["lost+found", ".trash", "Latest", NEWEST.strftime(NAME_FORMAT)])
+        self.assertEqual(planner.names, [NEWEST.strftime(NAME_FORMAT)])
+        self.assertEqual(planner.expired(), [])
+
+    def test_empty(self):
+        self.assertEqual(RetentionPlanner([]).expired(), [])
+        self.assertEqual(RetentionPlanner([]).plan(0, 100 * GB, Reclaim(GB)), [])
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_newest_never_planned(self):
+        planner = RetentionPlanner(backups(1, step=timedelta(hours=6)), max_deletions=10)
+        self.assertEqual(len(planner.names), 4)
+        plan = planner.plan(0, 100 * GB, Reclaim(GB))
+        planned = [name for name, reason, size in plan]
+        self.assertEqual(planned, planner.names[:-1])
+
+    def test_space_deletions_bounded(self):
+        # The disk stays full, e.g. because of data that is not a backup
+        planner = RetentionPlanner(backups(1))
+        reclaim = Reclaim(GB)
+        plan = planner.plan(0, 100 * GB, reclaim)
+        self.assertEqual(plan, [(name, REASON_SPACE, GB) for name in planner.names[:MAX_SPACE_DELETIONS]])
+        self.assertEqual(len(reclaim.calls), MAX_SPACE_DELETIONS)
+
+    def test_space_plan_stops_at_zero_reclaim(self):
+        planner = RetentionPlanner(backups(1))
+        sizes = iter([GB, GB, 0, GB])
+        plan = planner.plan(0, 100 * GB, lambda name: next(sizes))
+        self.assertEqual(plan, [(name, REASON_SPACE, GB) for name in planner.names[:2]])
+        self.assertEqual(planner.plan(0, 100 * GB, Reclaim(0)), [])
+
+    def test_single_backup(self):
+        plan = RetentionPlanner(backups(1, step=timedelta(days=1))).plan(0, 100 * GB, Reclaim(GB))
+        self.assertEqual(plan, [])
+
+    def test_rule_deletions_first(self):
+        planner = RetentionPlanner(backups(60))
+        expired = planner.expired()
+        plan = planner.plan(0, 100 * GB, Reclaim(GB))
+        self.assertEqual([name for name, reason, size in plan[:len(expired)]], expired)
+        self.assertTrue(all(reason == REASON_RULE for name, reason, size in plan[:len(expired)]))
+        self.assertTrue(all(reason == REASON_SPACE for name, reason, size in plan[len(expired):]))
+
+    def test_space_plan_stops_at_free_percent(self):
+        # Backups within a single day are not expired, only the space plan deletes them
+        planner = RetentionPlanner(backups(1))
+        self.assertEqual(planner.expired(), [])
+        total = 100 * GB
+        free = (FREE_PERCENT - 3) * GB
+        reclaim = Reclaim(GB)
+        plan = planner.plan(free, total, reclaim)
+        self.assertEqual(plan, [(name, REASON_SPACE, GB) for name in planner.names[:3]])
+        self.assertEqual(reclaim.calls, planner.names[:3])
+
+    def test_rule_deletions_count_towards_free_space(self):
+        planner = RetentionPlanner(backups(10))
+        expired = planner.expired()
+        total = 100 * GB
+        free = total * FREE_PERCENT / 100 - len(expired) * GB
+        plan = planner.plan(free, total, Reclaim(GB))
+        self.assertEqual([(name, REASON_RULE, GB) for name in expired], plan)
+
+    def test_enough_space(self):
+        planner = RetentionPlanner(backups(10))
+        reclaim = Reclaim(GB)
+        plan = planner.plan(50 * GB, 100 * GB, reclaim)
+        self.assertEqual(plan, [(name, REASON_RULE, None) for name in planner.expired()])
+        self.assertEqual(reclaim.calls, [])
+
+    def test_estimate(self):
+        planner = RetentionPlanner(backups(10))
+        reclaim = Reclaim(GB)
+        plan = planner.plan(50 * GB, 100 * GB, reclaim, estimate=True)
+        self.assertEqual(plan, [(name, REASON_RULE, GB) for name in planner.expired()])
+        self.assertEqual(reclaim.calls, planner.expired())
+
+    def test_without_reclaim(self):
+        planner = RetentionPlanner(backups(60))
+        plan = planner.plan(0, 100 * GB, None)
+        self.assertEqual(plan, [(name, REASON_RULE, None) for name in planner.expired()])
+        self.assertEqual(planner.plan(0, 100 * GB, None, estimate=True), plan)
+
+
+if __name__ == '__main__':
+    unittest.main()